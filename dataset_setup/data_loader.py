@@ -1,13 +1,48 @@
+import ast
+import io
 import json
 import logging
+import os
 import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from glob import glob
+from itertools import repeat
+from typing import Iterator, Optional
 
 import pandas as pd
-from sqlalchemy import create_engine
+import pyarrow.parquet as pq
+from sqlalchemy import select, Connection, Table
+from sqlalchemy.dialects import postgresql, sqlite
 
 from models import create_tables
-from models.db import get_postgres_conn_string
+from models.db import get_postgres_conn_string, create_db_engine
+from models.test_cases import TestCases
+from utils.cache_utils import hash_text
+
+CLEANED_DATASETS_DIRECTORY = os.path.join("resources", "cleaned_datasets")
+DATASET_CHUNK_SIZE = 10000
+DATASET_HEADERS = [
+    "task_id",
+    "question",
+    "level",
+    "answer",
+    "file_name",
+    "file_path",
+    "annotator_metadata",
+]
+BULK_LOAD_CHUNK_SIZE = 5000
+COPY_NULL = "\\N"
+TASK_ID_LOOKUP_CHUNK_SIZE = 1000
+LOAD_MODES = ["upsert", "append"]
+ANNOTATOR_METADATA_FIELDS = {
+    "metadata_steps": "Steps",
+    "metadata_num_steps": "Number of steps",
+    "metadata_time_taken": "How long did this take?",
+    "metadata_tools": "Tools",
+    "metadata_num_tools": "Number of tools",
+}
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -17,71 +52,156 @@ logging.basicConfig(
 )
 
 
-def load_datasets_from_filesystem() -> dict[str, pd.DataFrame]:
+def load_datasets_from_filesystem(
+    max_workers: Optional[int] = None, chunk_size: int = DATASET_CHUNK_SIZE
+) -> dict[str, pd.DataFrame]:
     """
     This function loads the datasets from filesystem and preprocesses them.
-    The function reads CSV files from the specified directory, assumes certain column names for consistency, and flattens 'annotator_metadata' into separate columns.
-    It also converts 'annotator_metadata' values from JSON format to Pandas DataFrame and then normalizes it using json_normalize.
-    Additionally, it checks if there are any CSV files in the specified directory, raising a ValueError if no datasets are found.
-    """
-    file_list = glob("resources/datasets/validation/*_all.csv")
-    dataset_headers = [
-        "task_id",
-        "question",
-        "level",
-        "answer",
-        "file_name",
-        "file_path",
-        "annotator_metadata",
-    ]
+    The function reads the Parquet or CSV files from the specified directory, assumes certain column names for consistency, and flattens 'annotator_metadata' into separate columns.
+    Parquet exports are preferred over CSV exports of the same dataset, as their metadata is already structured.
+    The files are processed in parallel across a process pool, each read in chunks of `chunk_size` rows, and each cleaned dataset is written to its own file in `CLEANED_DATASETS_DIRECTORY`.
+    Additionally, it checks if there are any datasets in the specified directory, raising a ValueError if no datasets are found.
+    :param max_workers: Number of files processed concurrently, defaults to the number of CPUs
+    :param chunk_size: Number of rows read at once from each file
+    :return: Cleaned dataset of each file
+    """
+    file_list = list_dataset_files()
+    if len(file_list) == 0:
+        raise ValueError("There are no datasets available in the resources path")
+
+    if len(file_list) == 1 or max_workers == 1:
+        return {file: process_dataset_file(file, chunk_size) for file in file_list}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(file_list, executor.map(process_dataset_file, file_list, repeat(chunk_size))))
+
+
+def stream_datasets_from_filesystem(chunk_size: int = DATASET_CHUNK_SIZE) -> Iterator[tuple[str, pd.DataFrame]]:
+    """
+    Yield the cleaned chunks of every dataset file as they are read, without materializing any whole dataset. The
+    cleaned datasets are still written to `CLEANED_DATASETS_DIRECTORY`.
+    :param chunk_size: Number of rows per chunk
+    :return: Iterator of (file, cleaned chunk)
+    """
+    file_list = list_dataset_files()
     if len(file_list) == 0:
         raise ValueError("There are no datasets available in the resources path")
 
-    cleaned_datasets = {}
     for file in file_list:
-        dataset_df = pd.read_csv(file, names=dataset_headers, header=0)
-        # dataset_df["created_at"] = pd.Timestamp.now()
-        # dataset_df["modified_at"] = pd.Timestamp.now()
-        dataset_df["annotator_metadata"] = dataset_df["annotator_metadata"].apply(
-            preprocess_annotator_metadata
-        )
+        yield from ((file, cleaned_chunk) for cleaned_chunk in clean_dataset_file(file, chunk_size))
+
+
+def process_dataset_file(file: str, chunk_size: int = DATASET_CHUNK_SIZE) -> pd.DataFrame:
+    cleaned_chunks = list(clean_dataset_file(file, chunk_size))
+    logger.info(f"Cleaned {sum(len(chunk) for chunk in cleaned_chunks)} rows from {file}")
+    return pd.concat(cleaned_chunks) if cleaned_chunks else pd.DataFrame()
 
-        # Flatten annotator_metadata fields
-        json_struct = json.loads(dataset_df.to_json(orient="records"))
-        flattened_dataset_df = pd.json_normalize(json_struct)
-        flattened_dataset_df.columns = [
-            col.replace("annotator_metadata.", "")
-            for col in flattened_dataset_df.columns
-        ]
-
-        # Fill N/A
-        flattened_dataset_df["metadata_num_tools"] = pd.to_numeric(
-            flattened_dataset_df["metadata_num_tools"], errors="coerce"
-        ).astype("Int64")
-
-        # Update file paths from S3
-        flattened_dataset_df["file_path"] = (
-            "damg7374-a1-store/" + flattened_dataset_df["file_name"]
-        )
 
-        flattened_dataset_df.to_csv("resources/cleaned_datasets/1.csv", index=False)
-        cleaned_datasets[file] = flattened_dataset_df
+def clean_dataset_file(file: str, chunk_size: int = DATASET_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Read a dataset file in chunks, clean each chunk and append it to the cleaned output of the file. The index of the
+    rows is their position in the file.
+    """
+    os.makedirs(CLEANED_DATASETS_DIRECTORY, exist_ok=True)
+    output_path = os.path.join(CLEANED_DATASETS_DIRECTORY, f"{os.path.splitext(os.path.basename(file))[0]}.csv")
+    header = True
+    for dataset_chunk in read_dataset_file(file, chunk_size):
+        cleaned_chunk = clean_dataset(dataset_chunk, file)
+        cleaned_chunk.to_csv(output_path, index=False, mode="w" if header else "a", header=header)
+        header = False
+        yield cleaned_chunk
 
-        print(flattened_dataset_df.columns)
 
-    return cleaned_datasets
+def read_dataset_file(file: str, chunk_size: int = DATASET_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    if not file.endswith(".parquet"):
+        yield from pd.read_csv(file, names=DATASET_HEADERS, header=0, chunksize=chunk_size)
+        return
 
+    offset = 0
+    for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_size):
+        dataset_chunk = batch.to_pandas()
+        dataset_chunk.columns = DATASET_HEADERS
+        dataset_chunk.index = pd.RangeIndex(offset, offset + len(dataset_chunk))
+        offset += len(dataset_chunk)
+        yield dataset_chunk
 
-def preprocess_annotator_metadata(metadata: str) -> dict:
-    logger.info("Fixing annotator metadata")
-    metadata_json = fix_json_structure(metadata)
-    return {
-        "metadata_steps": metadata_json["Steps"],
-        "metadata_num_steps": metadata_json["Number of steps"],
-        "metadata_time_taken": metadata_json["How long did this take?"],
-        "metadata_tools": metadata_json["Tools"],
-        "metadata_num_tools": metadata_json["Number of tools"],
-    }
+
+def clean_dataset(dataset_df: pd.DataFrame, dataset_name: str = "dataset") -> pd.DataFrame:
+    # Flatten annotator_metadata fields
+    flattened_dataset_df = flatten_annotator_metadata(dataset_df, dataset_name)
+
+    # Fill N/A
+    flattened_dataset_df["metadata_num_tools"] = pd.to_numeric(
+        flattened_dataset_df["metadata_num_tools"], errors="coerce"
+    ).astype("Int64")
+
+    # Questions without an attachment have an empty file name in the Hugging Face exports, and NaN in the CSV ones
+    flattened_dataset_df[["file_name", "file_path"]] = flattened_dataset_df[["file_name", "file_path"]].replace("", pd.NA)
+
+    # Update file paths from S3
+    flattened_dataset_df["file_path"] = (
+        "damg7374-a1-store/" + flattened_dataset_df["file_name"]
+    )
+    return flattened_dataset_df
+
+
+def list_dataset_files() -> list[str]:
+    """
+    Exported validation datasets. When a dataset was exported both as CSV and Parquet, the most recent export is used.
+    """
+    dataset_files = {}
+    for file in glob("resources/datasets/validation/*_all.parquet") + glob("resources/datasets/validation/*_all.csv"):
+        dataset = os.path.splitext(file)[0]
+        if dataset not in dataset_files or os.path.getmtime(file) > os.path.getmtime(dataset_files[dataset]):
+            dataset_files[dataset] = file
+    return sorted(dataset_files.values())
+
+
+def flatten_annotator_metadata(dataset_df: pd.DataFrame, dataset_name: str = "dataset") -> pd.DataFrame:
+    """
+    Replace the `annotator_metadata` column with one column per metadata field. Each row's metadata is parsed once and
+    the `metadata_*` columns are built from the parsed records directly. Rows whose metadata can't be parsed or lacks a
+    field are reported and dropped, as every field is required by `test_cases`.
+    :param dataset_df: Dataset with the raw `annotator_metadata` column
+    :param dataset_name: Name of the dataset in the report of the rows that failed to parse
+    :return: Dataset with the `metadata_*` columns
+    """
+    parsed_metadata = [parse_annotator_metadata(metadata) for metadata in dataset_df["annotator_metadata"]]
+    metadata_df = pd.DataFrame.from_records(
+        [metadata or {} for metadata in parsed_metadata],
+        index=dataset_df.index,
+        columns=list(ANNOTATOR_METADATA_FIELDS.values()),
+    )
+    metadata_df.columns = list(ANNOTATOR_METADATA_FIELDS)
+
+    failed_rows = metadata_df.isna().any(axis=1)
+    if failed_rows.any():
+        logger.error(
+            f"Failed to parse the annotator metadata of {failed_rows.sum()} rows in {dataset_name}, skipping tasks: "
+            f"{dataset_df.loc[failed_rows, 'task_id'].tolist()}"
+        )
+
+    flattened_dataset_df = pd.concat([dataset_df.drop(columns="annotator_metadata"), metadata_df], axis=1)
+    return flattened_dataset_df[~failed_rows]
+
+
+def parse_annotator_metadata(metadata) -> Optional[dict]:
+    """
+    Parse the annotator metadata of one row. Parquet exports hold the metadata as a dict already, CSV exports as the
+    Python representation of the dict, which is evaluated as a literal in a single pass.
+    :return: The metadata, or None if it can't be parsed
+    """
+    if isinstance(metadata, dict):
+        return metadata
+    if not isinstance(metadata, str):
+        return None
+    try:
+        parsed_metadata = ast.literal_eval(metadata)
+    except (ValueError, SyntaxError):
+        try:
+            parsed_metadata = fix_json_structure(metadata)
+        except json.JSONDecodeError:
+            return None
+    return parsed_metadata if isinstance(parsed_metadata, dict) else None
 
 
 def fix_json_structure(metadata: str) -> dict:
@@ -118,31 +238,172 @@ def transfer_attachment(source_file_path: str) -> str:
     ...
 
 
-def main():
+def prepare_test_cases(df: pd.DataFrame, table: Table = TestCases.__table__) -> pd.DataFrame:
+    """
+    Select the columns of the table from the cleaned dataset, with its row index as the `index` column, the load time
+    as `created_at` and `modified_at`, and the hash of each row's content as `content_hash`.
+    """
+    rows_df = df.reset_index()
+    content_columns = [column.name for column in table.columns if column.name in rows_df.columns]
+    rows_df["content_hash"] = compute_content_hashes(rows_df[content_columns].drop(columns="index"))
+    now = datetime.now()
+    for timestamp_column in ["created_at", "modified_at"]:
+        if timestamp_column not in rows_df.columns:
+            rows_df[timestamp_column] = now
+    return rows_df[[column.name for column in table.columns if column.name in rows_df.columns]]
+
+
+def compute_content_hashes(rows_df: pd.DataFrame) -> list[str]:
+    """
+    sha256 of each row's values, serialized as one JSON line per row.
+    """
+    if rows_df.empty:
+        return []
+    # New lines within values are escaped in JSON lines, so each line is exactly one row
+    return [hash_text(row) for row in rows_df.to_json(orient="records", lines=True).splitlines()]
+
+
+def bulk_load_test_cases(
+    connection: Connection,
+    df: pd.DataFrame,
+    table: Table = TestCases.__table__,
+    chunk_size: int = BULK_LOAD_CHUNK_SIZE,
+) -> int:
+    """
+    Bulk load the cleaned dataset into the table within the connection's transaction. Postgres connections through
+    psycopg2 stream the rows with `COPY FROM STDIN` in chunks of `chunk_size` rows, other engines insert them with a
+    single executemany.
+    :return: Number of rows loaded
+    """
+    rows_df = prepare_test_cases(df, table)
+    if connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2":
+        copy_from_stdin(connection, rows_df, table, chunk_size)
+    else:
+        records = rows_df.astype(object).where(rows_df.notna(), None).to_dict(orient="records")
+        if records:
+            connection.execute(table.insert(), records)
+    return len(rows_df)
+
+
+def copy_from_stdin(connection: Connection, rows_df: pd.DataFrame, table: Table, chunk_size: int = BULK_LOAD_CHUNK_SIZE):
+    """
+    Stream the rows into the table with `COPY FROM STDIN` as CSV. Missing values are written as `\\N`, as COPY would
+    otherwise load empty strings as NULL.
+    """
+    preparer = connection.dialect.identifier_preparer
+    columns = ", ".join(preparer.quote(column) for column in rows_df.columns)
+    copy_sql = f"COPY {preparer.format_table(table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+
+    cursor = connection.connection.cursor()
+    try:
+        for start in range(0, len(rows_df), chunk_size):
+            buffer = io.StringIO()
+            rows_df.iloc[start:start + chunk_size].to_csv(buffer, index=False, header=False, na_rep=COPY_NULL)
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+    finally:
+        cursor.close()
+
+
+def upsert_test_cases(connection: Connection, df: pd.DataFrame, table: Table = TestCases.__table__) -> dict:
+    """
+    Insert the new test cases and update the existing ones whose content hash differs, with
+    `INSERT ... ON CONFLICT (task_id) DO UPDATE`. Updated rows keep their `created_at` and get a new `modified_at`,
+    unchanged rows aren't written.
+    :return: Counts of the inserted, updated and unchanged rows
+    """
+    rows_df = prepare_test_cases(df, table)
+    # Only the stored hashes of these test cases are read, so streamed chunks don't each scan the whole table
+    task_ids = rows_df["task_id"].tolist()
+    existing_hashes = {}
+    for start in range(0, len(task_ids), TASK_ID_LOOKUP_CHUNK_SIZE):
+        existing_hashes.update(
+            connection.execute(
+                select(table.c.task_id, table.c.content_hash).where(
+                    table.c.task_id.in_(task_ids[start:start + TASK_ID_LOOKUP_CHUNK_SIZE])
+                )
+            ).all()
+        )
+    is_new = ~rows_df["task_id"].isin(existing_hashes.keys())
+    is_changed = ~is_new & (rows_df["task_id"].map(existing_hashes) != rows_df["content_hash"])
+    summary = {
+        "inserted": int(is_new.sum()),
+        "updated": int(is_changed.sum()),
+        "unchanged": int((~is_new & ~is_changed).sum()),
+    }
+
+    changed_df = rows_df[is_new | is_changed]
+    if changed_df.empty:
+        return summary
+
+    match connection.dialect.name:
+        case "postgresql":
+            insert_statement = postgresql.insert(table)
+        case "sqlite":
+            insert_statement = sqlite.insert(table)
+        case _:
+            raise ValueError(f"Upserts are not supported for {connection.dialect.name} databases")
+    upsert_statement = insert_statement.on_conflict_do_update(
+        index_elements=[table.c.task_id],
+        set_={
+            column: insert_statement.excluded[column]
+            for column in changed_df.columns
+            if column not in ["task_id", "created_at"]
+        },
+        where=table.c.content_hash.is_distinct_from(insert_statement.excluded.content_hash),
+    )
+    connection.execute(
+        upsert_statement,
+        changed_df.astype(object).where(changed_df.notna(), None).to_dict(orient="records"),
+    )
+    return summary
+
+
+def load_test_cases(connection: Connection, df: pd.DataFrame, mode: str = "upsert") -> dict:
+    if mode == "upsert":
+        return upsert_test_cases(connection, df)
+    return {"inserted": bulk_load_test_cases(connection, df)}
+
+
+def main(mode: str = "upsert", stream: bool = False, max_workers: Optional[int] = None, chunk_size: int = DATASET_CHUNK_SIZE):
     """
     Main function that loads datasets, sets up Postgres connection, creates tables if needed, and stores the cleaned data in the database.
+    All datasets are loaded in a single transaction, committed once every dataset is loaded.
+    :param mode: `upsert` only writes new and changed test cases and is safe to re-run, `append` bulk loads every test
+        case into an empty table
+    :param stream: Load each chunk of the datasets as it is read, instead of processing the whole files in parallel first
+    :param max_workers: Number of dataset files processed concurrently when not streaming
+    :param chunk_size: Number of rows read at once from the dataset files
     """
-    dataframes = load_datasets_from_filesystem()
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unsupported load mode: {mode}")
+    if stream:
+        datasets = stream_datasets_from_filesystem(chunk_size)
+    else:
+        datasets = load_datasets_from_filesystem(max_workers, chunk_size).items()
 
     # Setup Postgres connection
     postgres_conn_string = get_postgres_conn_string()
-    engine = create_engine(postgres_conn_string)
+    engine = create_db_engine(postgres_conn_string)
 
     # Create tables if they don't already exist
     create_tables(engine)
 
-    with engine.connect() as connection:
-        for df_name, df in dataframes.items():
-            start_time = time.time()
-            df.to_sql(
-                name="test_cases",
-                con=connection,
-                if_exists="append",
-            )
-            logger.info(
-                f"Created table `test_cases` from {df_name} in {time.time_ns() - start_time} sec"
-            )
-    logger.info("Completed loading datasets to database")
+    summaries = {}
+    start_time = time.perf_counter()
+    with engine.begin() as connection:
+        for df_name, df in datasets:
+            summary = summaries.setdefault(df_name, Counter())
+            summary.update(load_test_cases(connection, df, mode))
+    elapsed_time = time.perf_counter() - start_time
+
+    for df_name, summary in summaries.items():
+        logger.info(f"Loaded `test_cases` from {df_name} | {dict(summary)}")
+    loaded_rows = sum(sum(summary.values()) for summary in summaries.values())
+    logger.info(
+        f"Completed loading {loaded_rows} rows to database in {elapsed_time:.3f} sec "
+        f"({loaded_rows / max(elapsed_time, 1e-6):.0f} rows/sec)"
+    )
 
 
 if __name__ == "__main__":
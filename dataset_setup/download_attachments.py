@@ -1,7 +1,13 @@
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import formatdate
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+from utils.cache_utils import write_atomically
 
 # Base URL for the GitHub repository
 base_url = "https://github.com/aymeric-roucher/GAIA/tree/main/data/gaia/validation"
@@ -10,16 +16,18 @@ raw_base_url = (
 )
 
 # Directory where you want to save the downloaded files
-download_dir = "../resources/file_attachments/"
+download_dir = os.path.join("resources", "file_attachments")
 
-# Create directory if it doesn't exist
-if not os.path.exists(download_dir):
-    os.makedirs(download_dir)
+# Validators of the downloaded files, used for conditional requests on the next run
+MANIFEST_FILE_NAME = ".manifest.json"
+CHUNK_SIZE = 1024 * 1024
 
 
 # Function to get the file links from the GitHub directory page
-def get_file_links(url):
-    response = requests.get(url)
+def get_file_links(url, session=None):
+    from bs4 import BeautifulSoup
+
+    response = (session or requests).get(url, timeout=30)
     if response.status_code != 200:
         print(f"Failed to access {url}")
         return []
@@ -51,27 +59,132 @@ def get_file_links(url):
     return file_links
 
 
+def create_session(max_workers: int = 8) -> requests.Session:
+    """
+    HTTP session with a connection pool large enough for every download thread.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def load_manifest(download_dir) -> dict:
+    manifest_path = os.path.join(download_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, download_dir):
+    write_atomically(
+        os.path.join(download_dir, MANIFEST_FILE_NAME),
+        [json.dumps(manifest, indent=2, sort_keys=True).encode()],
+    )
+
+
+def download_file(session: requests.Session, file_url: str, file_path: str, validators: dict) -> (str, dict):
+    """
+    Download a file unless the local copy is still current. Files present locally are revalidated with a conditional
+    request and skipped if the server answers 304. Local files without recorded validators, e.g. scraped before the
+    manifest existed, are also skipped if the server sends a body of the same size.
+    :param validators: ETag, Last-Modified and size recorded when the file was last downloaded
+    :return: "downloaded" or "skipped", and the validators of the local file
+    """
+    headers = {}
+    local_size = os.path.getsize(file_path) if os.path.exists(file_path) else None
+    if local_size is not None:
+        if validators.get("size") == local_size and validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        headers["If-Modified-Since"] = validators.get("last_modified") or formatdate(
+            os.path.getmtime(file_path), usegmt=True
+        )
+
+    with session.get(file_url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 304:
+            return "skipped", {**validators, "size": local_size}
+        response.raise_for_status()
+
+        recorded = bool(validators)
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        # A 200 to a request with recorded validators means the file changed, even if its size didn't
+        content_length = response.headers.get("Content-Length")
+        if not recorded and local_size is not None and content_length is not None and int(content_length) == local_size:
+            return "skipped", {**validators, "size": local_size}
+
+        write_atomically(file_path, response.iter_content(chunk_size=CHUNK_SIZE))
+    return "downloaded", {**validators, "size": os.path.getsize(file_path)}
+
+
 # Function to download files from the raw URL
-def download_files(file_links, raw_base_url, download_dir):
-    for file_name in file_links:
-        file_url = f"{raw_base_url}{file_name}"
-        print(f"Downloading {file_url}...")
-
-        response = requests.get(file_url)
-        if response.status_code == 200:
-            file_path = os.path.join(download_dir, file_name)
-            with open(file_path, "wb") as f:
-                f.write(response.content)
-            print(f"Downloaded {file_name} successfully.")
-        else:
-            print(f"Failed to download {file_name}.")
-
-
-# Get the list of file links
-file_links = get_file_links(base_url)
-
-# Download the files
-if file_links:
-    download_files(file_links, raw_base_url, download_dir)
-else:
-    print("No files found to download.")
+def download_files(file_links, raw_base_url, download_dir, max_workers: int = 8, session=None) -> dict:
+    """
+    Download the files concurrently, streaming each one to disk.
+    :return: Summary of the downloaded, skipped and failed files with the downloaded bytes
+    """
+    os.makedirs(download_dir, exist_ok=True)
+    session = session or create_session(max_workers)
+    manifest = load_manifest(download_dir)
+    summary = {"downloaded": 0, "skipped": 0, "failed": 0, "bytes": 0}
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                download_file,
+                session,
+                f"{raw_base_url}{file_name}",
+                os.path.join(download_dir, file_name),
+                manifest.get(file_name, {}),
+            ): file_name
+            for file_name in file_links
+        }
+        for future in as_completed(futures):
+            file_name = futures[future]
+            try:
+                status, validators = future.result()
+            except Exception as e:
+                print(f"Failed to download {file_name} | Error: {e}")
+                summary["failed"] += 1
+                continue
+            manifest[file_name] = validators
+            summary[status] += 1
+            if status == "downloaded":
+                summary["bytes"] += validators["size"]
+    summary["seconds"] = round(time.perf_counter() - start_time, 2)
+
+    save_manifest(manifest, download_dir)
+    return summary
+
+
+def main(max_workers: int = 8) -> dict:
+    """
+    Scrape the GAIA validation attachments from GitHub into `download_dir`. Files that haven't changed since the last
+    run are skipped.
+    :param max_workers: Number of concurrent downloads
+    :return: Summary of the downloaded, skipped and failed files
+    """
+    session = create_session(max_workers)
+
+    # Get the list of file links
+    file_links = get_file_links(base_url, session)
+    if not file_links:
+        print("No files found to download.")
+        return {}
+
+    # Download the files
+    summary = download_files(file_links, raw_base_url, download_dir, max_workers, session)
+    print(
+        f"Downloaded {summary['downloaded']} files ({summary['bytes']} bytes), skipped {summary['skipped']} "
+        f"unchanged files, {summary['failed']} failed in {summary['seconds']} sec"
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    main()
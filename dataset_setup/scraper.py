@@ -1,10 +1,17 @@
+import argparse
+import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 
 import datasets
+from huggingface_hub import HfApi
 
 HUGGING_FACE_DATASET_URI = "gaia-benchmark/GAIA"
+DATASETS_DIRECTORY = os.path.join("resources", "datasets")
+EXPORT_STATE_FILE_NAME = "export_state.json"
+EXPORT_FORMATS = ["csv", "parquet"]
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -24,25 +31,116 @@ def load_token() -> str:
     return os.environ.get("HUGGING_FACE_TOKEN")
 
 
-def download_datasets() -> bool:
+def load_dataset_revision() -> str:
     """
-    Downloads a dataset from Hugging Face.
+    Current commit sha of the dataset on the Hugging Face Hub.
     """
+    return HfApi().dataset_info(HUGGING_FACE_DATASET_URI, token=load_token()).sha
+
+
+def load_export_state() -> dict:
+    state_path = os.path.join(DATASETS_DIRECTORY, EXPORT_STATE_FILE_NAME)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_export_state(state: dict):
+    os.makedirs(DATASETS_DIRECTORY, exist_ok=True)
+    with open(os.path.join(DATASETS_DIRECTORY, EXPORT_STATE_FILE_NAME), "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def is_export_current(export: dict, revision: str, output_format: str) -> bool:
+    """
+    Whether a config was exported from the same revision in the same format, and its files are still there.
+    """
+    return (
+        export.get("revision") == revision
+        and export.get("format") == output_format
+        and all(os.path.exists(file_path) for file_path in export.get("files", []))
+    )
+
+
+def export_config(config: str, revision: str, output_format: str) -> list[str]:
+    """
+    Load one dataset configuration and export each of its splits.
+    :return: Paths of the exported files
+    """
+    src_data: datasets.DatasetDict = datasets.load_dataset(
+        path=HUGGING_FACE_DATASET_URI, token=load_token(), name=config, revision=revision
+    )
+    logger.info(f"Loaded {HUGGING_FACE_DATASET_URI}/{config} dataset")
+
+    file_paths = []
+    for dataset_type, dataset in src_data.items():
+        file_path = os.path.join(DATASETS_DIRECTORY, dataset_type, f"{config}.{output_format}")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if output_format == "parquet":
+            # Parquet keeps the annotator metadata as a struct, so it doesn't need to be repaired when loading
+            dataset.to_parquet(file_path)
+        else:
+            dataset.to_csv(file_path)
+        file_paths.append(file_path)
+
+        # Remove the exports in other formats, so the loader can't read a stale one
+        for other_format in EXPORT_FORMATS:
+            stale_file_path = os.path.join(DATASETS_DIRECTORY, dataset_type, f"{config}.{other_format}")
+            if other_format != output_format and os.path.exists(stale_file_path):
+                os.remove(stale_file_path)
+    return file_paths
+
+
+def download_datasets(output_format: str = "csv", max_workers: int = 4, force: bool = False) -> bool:
+    """
+    Downloads the dataset configurations from Hugging Face in parallel and exports them to `DATASETS_DIRECTORY`.
+    Configurations already exported from the current revision of the dataset are skipped.
+    :param output_format: Either "csv" or "parquet"
+    :param max_workers: Number of configurations loaded concurrently
+    :param force: Export every configuration even if it is unchanged
+    :return: True once the datasets are exported
+    """
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {output_format}")
+
+    revision = load_dataset_revision()
     dataset_configurations = datasets.get_dataset_config_names(
-        path=HUGGING_FACE_DATASET_URI, token=load_token()
+        path=HUGGING_FACE_DATASET_URI, token=load_token(), revision=revision
     )
     logger.info(
-        f"Loaded {len(dataset_configurations)} dataset configurations for {HUGGING_FACE_DATASET_URI}"
+        f"Loaded {len(dataset_configurations)} dataset configurations for {HUGGING_FACE_DATASET_URI}@{revision}"
     )
-    for config in dataset_configurations:
-        src_data: datasets.DatasetDict = datasets.load_dataset(
-            path=HUGGING_FACE_DATASET_URI, token=load_token(), name=config
+
+    export_state = load_export_state()
+    stale_configurations = [
+        config
+        for config in dataset_configurations
+        if force or not is_export_current(export_state.get(config, {}), revision, output_format)
+    ]
+    if not stale_configurations:
+        logger.info(f"All datasets are up to date with revision {revision}, skipping export")
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        exported_files = executor.map(
+            lambda config: export_config(config, revision, output_format), stale_configurations
         )
-        logger.info(f"Loaded {HUGGING_FACE_DATASET_URI}/{config} dataset")
-        for dataset_type, dataset in src_data.items():
-            dataset.to_csv(f"resources/datasets/{dataset_type}/{config}.csv")
+        for config, file_paths in zip(stale_configurations, exported_files):
+            export_state[config] = {"revision": revision, "format": output_format, "files": file_paths}
+    save_export_state(export_state)
+
+    logger.info(
+        f"Exported {len(stale_configurations)} dataset configurations, "
+        f"skipped {len(dataset_configurations) - len(stale_configurations)} unchanged"
+    )
     return True
 
 
 if __name__ == "__main__":
-    download_datasets()
+    parser = argparse.ArgumentParser(description="Export the GAIA datasets from Hugging Face")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv", help="Output format of the datasets")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of configurations loaded concurrently")
+    parser.add_argument("--force", action="store_true", help="Export the datasets even if they are unchanged")
+    args = parser.parse_args()
+    download_datasets(output_format=args.format, max_workers=args.concurrency, force=args.force)
@@ -1,23 +1,134 @@
 import glob
+import hashlib
 import logging
+import math
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 
-from utils.file_system_utils import load_s3_bucket, get_s3_client
+from utils.file_system_utils import load_s3_bucket, get_s3_client, get_attachment_cache
 
 logger = logging.getLogger(__name__)
 ATTACHMENTS_DIRECTORY = "resources/file_attachments"
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_CHUNKSIZE,
+    max_concurrency=4,
+)
 
 
-def main():
+def main(max_workers: int = 16) -> dict:
+    """
+    Sync the local attachments to the S3 bucket. The bucket is listed once, and only files whose size or ETag differ
+    from their S3 object are uploaded.
+    :param max_workers: Number of files compared and uploaded concurrently
+    :return: Summary of the uploaded, skipped and failed files with their bytes
+    """
     bucket_name = load_s3_bucket()
-    files_list = glob.glob(ATTACHMENTS_DIRECTORY + "/*")
+    files_list = [file for file in glob.glob(ATTACHMENTS_DIRECTORY + "/*") if os.path.isfile(file)]
+    summary = {"uploaded": 0, "skipped": 0, "failed": 0, "uploaded_bytes": 0, "skipped_bytes": 0}
+
+    start_time = time.perf_counter()
+    remote_objects = list_bucket_objects(bucket_name)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(sync_file, file, bucket_name, remote_objects.get(os.path.basename(file))): file
+            for file in files_list
+        }
+        for future in as_completed(futures):
+            file = futures[future]
+            size = os.path.getsize(file)
+            try:
+                uploaded = future.result()
+            except Exception as e:
+                logger.error(f"Failed to upload {file} | Error: {e}")
+                summary["failed"] += 1
+                continue
+            summary["uploaded" if uploaded else "skipped"] += 1
+            summary["uploaded_bytes" if uploaded else "skipped_bytes"] += size
+    summary["seconds"] = round(time.perf_counter() - start_time, 2)
+
+    print(
+        f"Uploaded {summary['uploaded']} files ({summary['uploaded_bytes']} bytes), "
+        f"skipped {summary['skipped']} unchanged files ({summary['skipped_bytes']} bytes), "
+        f"{summary['failed']} failed in {summary['seconds']} sec"
+    )
+    return summary
+
+
+def list_bucket_objects(bucket: str) -> dict[str, dict]:
+    """
+    List every object of the bucket.
+    :return: Size and ETag of each object by key
+    """
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    remote_objects = {}
+    for page in paginator.paginate(Bucket=bucket):
+        for remote_object in page.get("Contents", []):
+            remote_objects[remote_object["Key"]] = {
+                "size": remote_object["Size"],
+                "etag": remote_object["ETag"].strip('"'),
+            }
+    return remote_objects
+
+
+def sync_file(file_name: str, bucket: str, remote_object: Optional[dict] = None) -> bool:
+    """
+    Upload the file unless its S3 object already has the same size and ETag. Uploaded files are added to the local
+    attachment cache, so they aren't downloaded again by the benchmark.
+    :return: True if the file was uploaded, False if it was unchanged
+    """
+    if remote_object is not None and is_unchanged(file_name, remote_object):
+        return False
+    if not upload_file(file_name, bucket):
+        raise ValueError(f"Failed to upload {file_name} to {bucket}")
+
+    try:
+        get_attachment_cache().add(f"{bucket}/{os.path.basename(file_name)}", file_name, f'"{compute_etag(file_name)}"')
+    except OSError as e:
+        logger.warning(f"Failed to add {file_name} to the local attachment cache | Error: {e}")
+    return True
+
+
+def is_unchanged(file_name: str, remote_object: dict) -> bool:
+    size = os.path.getsize(file_name)
+    if size != remote_object["size"]:
+        return False
+    etag = remote_object["etag"]
+    if "-" not in etag:
+        return compute_etag(file_name, multipart=False) == etag
+    # Multipart ETags depend on the part size used for the upload, which is inferred from the part count if it differs
+    parts = int(etag.split("-")[1])
+    chunksize = MULTIPART_CHUNKSIZE
+    if math.ceil(size / chunksize) != parts:
+        chunksize = math.ceil(size / parts / (1024 * 1024)) * 1024 * 1024
+    return compute_etag(file_name, chunksize, multipart=True) == etag
+
+
+def compute_etag(file_name: str, chunksize: int = MULTIPART_CHUNKSIZE, multipart: Optional[bool] = None) -> str:
+    """
+    Compute the S3 ETag of a file: the MD5 of its content, or for multipart uploads the MD5 of the concatenated part
+    MD5s followed by the part count.
+    :param multipart: Whether the file was uploaded in parts, defaults to whether it exceeds `MULTIPART_THRESHOLD`
+    """
+    if multipart is None:
+        multipart = os.path.getsize(file_name) >= MULTIPART_THRESHOLD
 
-    for idx, file in enumerate(files_list):
-        success = upload_file(file, bucket_name)
-        if not success:
-            logger.error(f"Failed to upload {idx} | {file}")
+    md5 = hashlib.md5()
+    part_digests = []
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunksize), b""):
+            md5.update(chunk)
+            part_digests.append(hashlib.md5(chunk).digest())
+    if not multipart:
+        return md5.hexdigest()
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
 
 
 def upload_file(file_name, bucket, object_name=None):
@@ -33,10 +144,10 @@ def upload_file(file_name, bucket, object_name=None):
     if object_name is None:
         object_name = os.path.basename(file_name)
 
-    # Upload the file
+    # Upload the file, in parts if it is large
     s3_client = get_s3_client()
     try:
-        response = s3_client.upload_file(file_name, bucket, object_name)
+        s3_client.upload_file(file_name, bucket, object_name, Config=TRANSFER_CONFIG)
     except ClientError as e:
         logging.error(e)
         return False
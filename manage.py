@@ -1,15 +1,70 @@
 import argparse
 import sys
 
-from dataset_setup.data_loader import main as data_loader_main
+from dataset_setup.data_loader import main as data_loader_main, LOAD_MODES, DATASET_CHUNK_SIZE
+from models.test_cases import fetch_attachment_paths
+from utils.batch_utils import run_batch_benchmark
+from utils.benchmark_utils import (
+    run_benchmark,
+    transcribe_audio_attachments,
+    DEFAULT_BENCHMARK_MODELS,
+    DEFAULT_BENCHMARK_CONCURRENCY,
+    DEFAULT_TRANSCRIPTION_CONCURRENCY,
+)
+from utils.file_system_utils import prefetch_files
 
 
 def invoke_function1(args):
     """
     Wrapper to invoke function1 with command-line arguments.
     """
-    print(f"Invoking data loader")
-    data_loader_main()
+    print(f"Invoking data loader in {args.mode} mode")
+    data_loader_main(
+        mode=args.mode,
+        stream=args.stream,
+        max_workers=args.concurrency,
+        chunk_size=args.chunk_size,
+    )
+
+
+def invoke_benchmark(args):
+    """
+    Wrapper to invoke the benchmark runner with command-line arguments.
+    """
+    print(f"Invoking benchmark in {args.mode} mode")
+    if args.mode == "batch":
+        run_batch_benchmark(models=args.model, limit=args.limit)
+    else:
+        run_benchmark(
+            models=args.model,
+            concurrency=args.concurrency,
+            limit=args.limit,
+            use_cache=not args.no_cache,
+        )
+
+
+def invoke_transcribe(args):
+    """
+    Wrapper to invoke the audio pre-transcription stage with command-line arguments.
+    """
+    print("Invoking audio transcription")
+    transcribe_audio_attachments(concurrency=args.concurrency)
+
+
+def invoke_prefetch(args):
+    """
+    Wrapper to invoke the attachment prefetch stage with command-line arguments.
+    """
+    print("Invoking attachment prefetch")
+    summary = prefetch_files(
+        fetch_attachment_paths(),
+        max_workers=args.concurrency,
+        revalidate=args.revalidate,
+    )
+    print(
+        f"Downloaded {summary['downloaded']} attachments ({summary['bytes']} bytes, {summary['mb_per_second']} MB/s), "
+        f"{summary['cached']} already cached, {summary['failed']} failed in {summary['seconds']} sec"
+    )
 
 
 def main():
@@ -21,8 +76,88 @@ def main():
 
     # Add a subparser for function1
     parser_function1 = subparsers.add_parser("data_loader", help="Invoke data loader")
+    parser_function1.add_argument(
+        "--mode",
+        choices=LOAD_MODES,
+        default="upsert",
+        help="Upsert only the new and changed test cases, or append every test case to an empty table",
+    )
+    parser_function1.add_argument(
+        "--stream",
+        action="store_true",
+        help="Load each chunk of the datasets as it is read instead of processing whole files first",
+    )
+    parser_function1.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="Number of dataset files processed in parallel (default: number of CPUs)",
+    )
+    parser_function1.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DATASET_CHUNK_SIZE,
+        help="Number of rows read at once from the dataset files",
+    )
     parser_function1.set_defaults(func=invoke_function1)
 
+    # Add a subparser for the benchmark runner
+    parser_benchmark = subparsers.add_parser(
+        "benchmark", help="Evaluate all test cases against OpenAI models"
+    )
+    parser_benchmark.add_argument(
+        "--model",
+        action="append",
+        help=f"Model to evaluate, can be repeated (default: {', '.join(DEFAULT_BENCHMARK_MODELS)})",
+    )
+    parser_benchmark.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_BENCHMARK_CONCURRENCY,
+        help="Number of concurrent requests per model",
+    )
+    parser_benchmark.add_argument(
+        "--limit", type=int, help="Only evaluate the first N test cases"
+    )
+    parser_benchmark.add_argument(
+        "--mode",
+        choices=["sync", "batch"],
+        default="sync",
+        help="Invoke OpenAI per test case (sync), or submit the test cases without attachments to the Batch API (batch)",
+    )
+    parser_benchmark.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore cached OpenAI responses and re-run every question",
+    )
+    parser_benchmark.set_defaults(func=invoke_benchmark)
+
+    # Add a subparser for the audio pre-transcription stage
+    parser_transcribe = subparsers.add_parser(
+        "transcribe", help="Transcribe all audio attachments ahead of a benchmark run"
+    )
+    parser_transcribe.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_TRANSCRIPTION_CONCURRENCY,
+        help="Number of concurrent transcriptions",
+    )
+    parser_transcribe.set_defaults(func=invoke_transcribe)
+
+    # Add a subparser for the attachment prefetch stage
+    parser_prefetch = subparsers.add_parser(
+        "prefetch", help="Download all attachments into the local cache"
+    )
+    parser_prefetch.add_argument(
+        "--concurrency", type=int, default=16, help="Number of concurrent downloads"
+    )
+    parser_prefetch.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="Re-download cached attachments that changed on S3",
+    )
+    parser_prefetch.set_defaults(func=invoke_prefetch)
+
     # Parse the command-line arguments
     args = parser.parse_args()
 
@@ -1,9 +1,9 @@
 import logging
 
-from sqlalchemy import Engine
+from sqlalchemy import Engine, Table, inspect, text
 
 from .benchmark_results import Base as OperationsBase
-from .test_cases import Base as TestBase
+from .test_cases import Base as TestBase, TestCases
 
 logger = logging.getLogger(__name__)
 
@@ -11,4 +11,24 @@ logger = logging.getLogger(__name__)
 def create_tables(engine: Engine):
     TestBase.metadata.create_all(engine)
     OperationsBase.metadata.create_all(engine)
+    add_missing_columns(engine, TestCases.__table__)
     logger.info("Created table `benchmark_results` and `test_cases`")
+
+
+def add_missing_columns(engine: Engine, table: Table):
+    """
+    Add the nullable columns of the model that are missing from a table created by an earlier version of the model.
+    """
+    existing_columns = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name in existing_columns or not column.nullable:
+                continue
+            connection.execute(
+                text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.quote(column.name)} {column.type.compile(engine.dialect)}"
+                )
+            )
+            logger.info(f"Added column `{column.name}` to table `{table.name}`")
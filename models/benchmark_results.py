@@ -44,6 +44,16 @@ def create_benchmark_result(
         return new_benchmark_result
 
 
+def create_benchmark_results(benchmark_results: list[dict]):
+    """
+    Store many benchmark results in a single transaction.
+    :param benchmark_results: Column values of each result, with the same keys as `create_benchmark_result` arguments
+    """
+    with db_session() as session:
+        session.add_all([BenchmarkResults(**result) for result in benchmark_results])
+        session.commit()
+
+
 def fetch_benchmark_results():
     with db_session() as session:
         results = session.query(BenchmarkResults).all()
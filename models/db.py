@@ -1,12 +1,23 @@
 import logging
 import os
+import threading
+import time
 from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, Engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 1800
+SLOW_CHECKOUT_SECONDS = 1.0
+
 
 def get_postgres_conn_string():
     if "POSTGRES_CONN_STRING" not in os.environ:
@@ -14,6 +25,117 @@ def get_postgres_conn_string():
     return os.environ["POSTGRES_CONN_STRING"]
 
 
+class PoolMetrics:
+    """
+    Thread-safe counters of the connection checkouts of a pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_events = 0
+        self.timeouts = 0
+        self.total_checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+        self.peak_in_use = 0
+
+    def record_checkout(self, seconds: float, in_use: int, overflowed: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.total_checkout_seconds += seconds
+            self.max_checkout_seconds = max(self.max_checkout_seconds, seconds)
+            self.peak_in_use = max(self.peak_in_use, in_use)
+            if overflowed:
+                self.overflow_events += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "overflow_events": self.overflow_events,
+                "timeouts": self.timeouts,
+                "avg_checkout_ms": round(1000 * self.total_checkout_seconds / max(self.checkouts, 1), 3),
+                "max_checkout_ms": round(1000 * self.max_checkout_seconds, 3),
+                "peak_in_use": self.peak_in_use,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    `QueuePool` recording the latency of each checkout, the connections in use and the checkouts that had to open an
+    overflow connection or timed out waiting for one.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self):
+        # Keep the counters when the engine is disposed
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        overflow = self.overflow()
+        start_time = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_timeout()
+            logger.error(f"Timed out waiting for a database connection | {self.pool_stats()}")
+            raise
+        elapsed_time = time.perf_counter() - start_time
+
+        overflowed = self.overflow() > max(overflow, 0)
+        self.metrics.record_checkout(elapsed_time, self.checkedout(), overflowed)
+        if overflowed:
+            logger.warning(f"Opened an overflow database connection | {self.pool_stats()}")
+        if elapsed_time > SLOW_CHECKOUT_SECONDS:
+            logger.warning(f"Waited {elapsed_time:.3f} sec for a database connection | {self.pool_stats()}")
+        return connection
+
+    def pool_stats(self) -> dict:
+        return {
+            "size": self.size(),
+            "in_use": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            **self.metrics.stats(),
+        }
+
+
+def load_engine_options(conn_string: str) -> dict:
+    """
+    Engine options read from the environment:
+    `POSTGRES_POOL_SIZE`, `POSTGRES_MAX_OVERFLOW`, `POSTGRES_POOL_TIMEOUT` (sec), `POSTGRES_POOL_PRE_PING`,
+    `POSTGRES_POOL_RECYCLE` (sec) and `POSTGRES_STATEMENT_TIMEOUT_MS`, which is only applied to Postgres connections.
+    """
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.environ.get("POSTGRES_POOL_SIZE", DEFAULT_POOL_SIZE)),
+        "max_overflow": int(os.environ.get("POSTGRES_MAX_OVERFLOW", DEFAULT_MAX_OVERFLOW)),
+        "pool_timeout": float(os.environ.get("POSTGRES_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT)),
+        "pool_pre_ping": os.environ.get("POSTGRES_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        "pool_recycle": int(os.environ.get("POSTGRES_POOL_RECYCLE", DEFAULT_POOL_RECYCLE)),
+    }
+    statement_timeout_ms = int(os.environ.get("POSTGRES_STATEMENT_TIMEOUT_MS") or 0)
+    if statement_timeout_ms > 0 and make_url(conn_string).get_backend_name() == "postgresql":
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout_ms}"}
+    return options
+
+
+def create_db_engine(conn_string: str) -> Engine:
+    """
+    Create an engine with a pool configured from the environment, see `load_engine_options`.
+    :param conn_string: Database URL
+    """
+    return create_engine(conn_string, **load_engine_options(conn_string))
+
+
 class DatabaseSession:
     _instance = None
 
@@ -22,7 +144,7 @@ class DatabaseSession:
             logger.info("Created new database session object")
             conn_string = get_postgres_conn_string()
             cls._instance = super().__new__(cls)
-            cls._instance.db_engine = create_engine(conn_string)
+            cls._instance.db_engine = create_db_engine(conn_string)
             cls._instance.session_maker = scoped_session(
                 sessionmaker(
                     autocommit=False, autoflush=True, bind=cls._instance.db_engine
@@ -35,12 +157,22 @@ class DatabaseSession:
         return cls().session_maker()
 
 
+def get_pool_stats() -> dict:
+    """
+    Size, connections in use, overflow and checkout metrics of the shared database pool.
+    """
+    return DatabaseSession().db_engine.pool.pool_stats()
+
+
 @contextmanager
 def db_session():
     _session = DatabaseSession.db_session()
     try:
         yield _session
     except Exception as e:
-        raise ValueError(f"Failed to connect to database: {e}")
+        # Surface the original error, e.g. a pool `TimeoutError`, instead of a generic one
+        logger.error(f"Database session failed | {type(e).__name__}: {e}")
+        _session.rollback()
+        raise
     finally:
         _session.close()
@@ -23,6 +23,7 @@ class TestCases(Base):
     metadata_time_taken = Column(String(30), nullable=False)
     metadata_tools = Column(String(115), nullable=False)
     metadata_num_tools = Column(Integer(), nullable=True)
+    content_hash = Column(String(64), nullable=True)
     created_at = Column(DateTime(), default=datetime.now)
     modified_at = Column(DateTime(), default=datetime.now)
 
@@ -40,6 +41,17 @@ def fetch_all_tests():
         ).order_by(TestCases.index).all()
 
 
+def fetch_attachment_paths() -> list[str]:
+    with db_session() as session:
+        rows = (
+            session.query(TestCases.file_path)
+            .filter(TestCases.file_path.isnot(None))
+            .distinct()
+            .all()
+        )
+        return [row.file_path for row in rows]
+
+
 def fetch_test_by_id(task_id: str):
     with db_session() as session:
         return session.query(TestCases).filter(TestCases.task_id == task_id).first()
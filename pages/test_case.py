@@ -1,6 +1,7 @@
 import streamlit as st
 from models.benchmark_results import create_benchmark_result
 from models.test_cases import fetch_all_tests
+from utils.benchmark_utils import is_answer_correct
 from utils.openai_utils import invoke_openai_api
 
 def app():
@@ -49,6 +50,7 @@ def app():
     # Selectbox for model selection
     model_options = ["gpt-4o-2024-05-13", "gpt-4o-mini-2024-07-18"]
     selected_model = st.selectbox("Select a Model", model_options, key="model_select")
+    bypass_cache = st.checkbox("Bypass response cache", key="bypass_cache_checkbox")
 
     # Get answer from OpenAI model
     if st.button("Get OpenAI Answer", key="get_answer_button"):
@@ -57,12 +59,13 @@ def app():
                 st.session_state.model_answer = invoke_openai_api(
                     question=question,
                     file_path=file_path,
-                    model=selected_model
+                    model=selected_model,
+                    use_cache=not bypass_cache,
                 )
                 st.markdown("**Model Answer:**")
                 st.markdown(f"<div style='background-color: rgba(255, 255, 255, 0.7); padding: 10px; border-radius: 5px;'>{st.session_state.model_answer}</div>", unsafe_allow_html=True)
 
-                if expected_answer.strip().lower() in st.session_state.model_answer.strip().lower():
+                if is_answer_correct(expected_answer, st.session_state.model_answer):
                     st.success("The model's answer matches the expected answer!")
                 else:
                     st.error("The model's answer is incorrect.")
@@ -82,7 +85,7 @@ def app():
                         model_name=selected_model,
                         prompted_question=question,
                         task_id=context,
-                        status="Accepted" if expected_answer.strip().lower() in st.session_state.model_answer.strip().lower() else "Failed",
+                        status="Accepted" if is_answer_correct(expected_answer, st.session_state.model_answer) else "Failed",
                     )
                     st.success("Answer accepted and stored successfully!")
                 except Exception as e:
@@ -117,12 +120,13 @@ def app():
                     st.session_state.re_evaluated_answer = invoke_openai_api(
                         question=combined_question,
                         file_path=file_path,
-                        model=selected_model
+                        model=selected_model,
+                        use_cache=not bypass_cache,
                     )
                     st.markdown("**Model Answer After Re-evaluation:**")
                     st.markdown(f"<div style='background-color: rgba(255, 255, 255, 0.7); padding: 10px; border-radius: 5px;'>{st.session_state.re_evaluated_answer}</div>", unsafe_allow_html=True)
 
-                    if expected_answer.strip().lower() in st.session_state.re_evaluated_answer.strip().lower():
+                    if is_answer_correct(expected_answer, st.session_state.re_evaluated_answer):
                         st.success("The model's answer matches the expected answer!")
                         st.session_state.re_evaluated_status = "Accepted"
                     else:
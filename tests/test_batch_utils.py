@@ -0,0 +1,174 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from openai import OpenAI
+
+from utils.batch_utils import build_batch_requests, parse_batch_output, run_batch_benchmark
+
+
+class StandInOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the OpenAI files and batches endpoints. Every batch completes on its second retrieval and
+    answers each request with `answer to <question>`, except the batches of `failed_models`, which fail, and of
+    `erroring_models`, whose requests all fail into the error file.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body: dict):
+        self._send(json.dumps(body).encode(), "application/json")
+
+    def _send(self, content: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _batch(self, batch_id: str, status: str) -> dict:
+        batch = self.server.batches[batch_id]
+        erroring = batch["model"] in self.server.erroring_models
+        return {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": "/v1/chat/completions",
+            "input_file_id": batch["input_file_id"],
+            "completion_window": "24h",
+            "status": status,
+            "output_file_id": f"{batch_id}-output" if status == "completed" and not erroring else None,
+            "error_file_id": f"{batch_id}-errors" if status == "completed" and erroring else None,
+            "created_at": 0,
+        }
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/files":
+            file_id = f"file-{len(self.server.files)}"
+            self.server.files[file_id] = [
+                json.loads(line) for line in body.decode().splitlines() if line.startswith('{"custom_id"')
+            ]
+            self._send_json(
+                {
+                    "id": file_id,
+                    "object": "file",
+                    "bytes": len(body),
+                    "created_at": 0,
+                    "filename": "batch.jsonl",
+                    "purpose": "batch",
+                    "status": "processed",
+                }
+            )
+        elif self.path == "/v1/batches":
+            request = json.loads(body)
+            batch_id = f"batch-{len(self.server.batches)}"
+            model = self.server.files[request["input_file_id"]][0]["body"]["model"]
+            self.server.batches[batch_id] = {"input_file_id": request["input_file_id"], "model": model, "polls": 0}
+            self._send_json(self._batch(batch_id, "validating"))
+
+    def do_GET(self):
+        if self.path.startswith("/v1/batches/"):
+            batch_id = self.path.split("/")[-1]
+            self.server.batches[batch_id]["polls"] += 1
+            status = "completed" if self.server.batches[batch_id]["polls"] >= 2 else "in_progress"
+            if status == "completed" and self.server.batches[batch_id]["model"] in self.server.failed_models:
+                status = "failed"
+            self._send_json(self._batch(batch_id, status))
+        elif self.path.endswith("/content"):
+            file_id = self.path.split("/")[-2]
+            batch_id = file_id.rsplit("-", 1)[0]
+            batch_requests = self.server.files[self.server.batches[batch_id]["input_file_id"]]
+            output = []
+            for batch_request in batch_requests:
+                question = batch_request["body"]["messages"][-1]["content"]
+                if file_id.endswith("-errors"):
+                    response = {"status_code": 400, "body": {"error": {"message": "Invalid request"}}}
+                else:
+                    response = {"status_code": 200, "body": {"choices": [{"message": {"content": f"answer to {question}"}}]}}
+                output.append({"custom_id": batch_request["custom_id"], "response": response, "error": None})
+            self._send("\n".join(json.dumps(line) for line in output).encode(), "application/jsonl")
+
+
+@pytest.fixture
+def stand_in_client():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInOpenAIHandler)
+    server.files = {}
+    server.batches = {}
+    server.failed_models = set()
+    server.erroring_models = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, OpenAI(api_key="test_key", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0)
+    server.shutdown()
+    server.server_close()
+
+
+def _test_case(task_id, answer, file_path=None):
+    return SimpleNamespace(task_id=task_id, question=f"question {task_id}", answer=answer, file_path=file_path)
+
+
+def test_build_batch_requests():
+    batch_requests = build_batch_requests([_test_case("1", "x")], "gpt-4")
+    assert batch_requests[0]["custom_id"] == "1"
+    assert batch_requests[0]["url"] == "/v1/chat/completions"
+    assert batch_requests[0]["body"]["model"] == "gpt-4"
+    assert batch_requests[0]["body"]["messages"][-1] == {"role": "user", "content": "question 1"}
+
+
+def test_parse_batch_output():
+    output = "\n".join(
+        [
+            json.dumps({"custom_id": "1", "response": {"status_code": 200, "body": {"choices": [{"message": {"content": "42"}}]}}, "error": None}),
+            json.dumps({"custom_id": "2", "response": {"status_code": 500, "body": {}}, "error": None}),
+            json.dumps({"custom_id": "3", "response": None, "error": {"code": "failed"}}),
+        ]
+    )
+    assert parse_batch_output(output) == {"1": "42", "2": None, "3": None}
+
+
+@patch('utils.batch_utils.create_benchmark_results')
+@patch('utils.batch_utils.fetch_all_tests')
+@patch('utils.batch_utils.get_openai_client')
+def test_run_batch_benchmark(mock_get_openai_client, mock_fetch_all_tests, mock_create_benchmark_results, stand_in_client, tmp_path):
+    _, mock_get_openai_client.return_value = stand_in_client
+    mock_fetch_all_tests.return_value = [
+        _test_case("1", "question 1"),
+        _test_case("2", "something else"),
+        _test_case("3", "question 3", "bucket/3.pdf"),
+    ]
+
+    with patch('utils.batch_utils.BATCH_DIRECTORY', str(tmp_path)):
+        summary = run_batch_benchmark(models=["model-a", "model-b"], poll_interval=0.01)
+
+    for model in ["model-a", "model-b"]:
+        assert summary[model] == {"Accepted": 1, "Failed": 1}
+    assert mock_create_benchmark_results.call_count == 2
+    stored_results = mock_create_benchmark_results.call_args_list[0].args[0]
+    assert {result["task_id"]: result["status"] for result in stored_results} == {"1": "Accepted", "2": "Failed"}
+    assert all(result["model_name"] == "model-a" for result in stored_results)
+    assert len(list(tmp_path.glob("*.jsonl"))) == 2
+
+
+@patch('utils.batch_utils.create_benchmark_results')
+@patch('utils.batch_utils.fetch_all_tests')
+@patch('utils.batch_utils.get_openai_client')
+def test_run_batch_benchmark_isolates_failed_batches(mock_get_openai_client, mock_fetch_all_tests, mock_create_benchmark_results, stand_in_client, tmp_path):
+    server, mock_get_openai_client.return_value = stand_in_client
+    server.failed_models.add("model-a")
+    server.erroring_models.add("model-b")
+    mock_fetch_all_tests.return_value = [_test_case("1", "question 1"), _test_case("2", "something else")]
+
+    with patch('utils.batch_utils.BATCH_DIRECTORY', str(tmp_path)):
+        summary = run_batch_benchmark(models=["model-a", "model-b", "model-c"], poll_interval=0.01)
+
+    assert summary == {
+        "model-a": {"Error": 2},
+        "model-b": {"Error": 2},
+        "model-c": {"Accepted": 1, "Failed": 1},
+    }
+    stored_models = [call.args[0][0]["model_name"] for call in mock_create_benchmark_results.call_args_list if call.args[0]]
+    assert stored_models == ["model-c"]
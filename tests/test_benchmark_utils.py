@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from utils.file_system_utils import Attachment
+from utils.benchmark_utils import is_answer_correct, run_benchmark, transcribe_audio_attachments
+
+
+def _test_case(task_id, answer, file_path=None):
+    return SimpleNamespace(
+        task_id=task_id, question=f"question {task_id}", answer=answer, file_path=file_path
+    )
+
+
+def test_is_answer_correct():
+    assert is_answer_correct(" Paris ", "The capital is paris.")
+    assert not is_answer_correct("Paris", "The capital is Rome.")
+
+
+@patch('utils.benchmark_utils.get_pool_stats')
+@patch('utils.benchmark_utils.prefetch_files')
+@patch('utils.benchmark_utils.get_response_cache')
+@patch('utils.benchmark_utils.create_benchmark_result')
+@patch('utils.benchmark_utils.invoke_openai_api')
+@patch('utils.benchmark_utils.fetch_all_tests')
+def test_run_benchmark(mock_fetch_all_tests, mock_invoke_openai_api, mock_create_benchmark_result, mock_get_response_cache, mock_prefetch_files, mock_get_pool_stats):
+    mock_fetch_all_tests.return_value = [
+        _test_case("1", "42"),
+        _test_case("2", "blue", "bucket/2.png"),
+        _test_case("3", "seven"),
+    ]
+    answers = {"question 1": "The answer is 42", "question 2": "red"}
+
+    def _invoke(question, file_path, model, use_cache):
+        if question not in answers:
+            raise ValueError("API failure")
+        return answers[question]
+
+    mock_invoke_openai_api.side_effect = _invoke
+
+    summary = run_benchmark(models=["model-a", "model-b"], concurrency=2)
+
+    for model in ["model-a", "model-b"]:
+        assert summary[model] == {"Accepted": 1, "Failed": 1, "Error": 1}
+    assert mock_invoke_openai_api.call_count == 6
+    assert mock_create_benchmark_result.call_count == 4
+    mock_invoke_openai_api.assert_any_call(question="question 2", file_path="bucket/2.png", model="model-b", use_cache=True)
+    mock_prefetch_files.assert_called_once_with(["bucket/2.png"], max_workers=2)
+    mock_get_pool_stats.assert_called_once()
+
+
+@patch('utils.benchmark_utils.get_pool_stats')
+@patch('utils.benchmark_utils.prefetch_files')
+@patch('utils.benchmark_utils.get_response_cache')
+@patch('utils.benchmark_utils.create_benchmark_result')
+@patch('utils.benchmark_utils.invoke_openai_api')
+@patch('utils.benchmark_utils.fetch_all_tests')
+def test_run_benchmark_limit(mock_fetch_all_tests, mock_invoke_openai_api, mock_create_benchmark_result, mock_get_response_cache, mock_prefetch_files, mock_get_pool_stats):
+    mock_fetch_all_tests.return_value = [_test_case(str(i), "x") for i in range(5)]
+    mock_invoke_openai_api.return_value = "x"
+
+    summary = run_benchmark(models=["model-a"], limit=2)
+
+    assert summary["model-a"] == {"Accepted": 2}
+    assert mock_invoke_openai_api.call_count == 2
+
+
+@patch('utils.benchmark_utils.get_transcript_store')
+@patch('utils.benchmark_utils.transcribe_audio')
+@patch('utils.benchmark_utils.load_file')
+@patch('utils.benchmark_utils.fetch_attachment_paths')
+def test_transcribe_audio_attachments(mock_fetch_attachment_paths, mock_load_file, mock_transcribe_audio, mock_get_transcript_store):
+    mock_fetch_attachment_paths.return_value = ["bucket/a.mp3", "bucket/b.pdf", "bucket/c.MP3", "bucket/d.wav"]
+    mock_load_file.side_effect = lambda key: Attachment("local/" + key.split("/")[-1])
+    mock_transcribe_audio.side_effect = lambda path: "" if path != "local/d.wav" else 1 / 0
+
+    summary = transcribe_audio_attachments(concurrency=2)
+
+    assert summary == {"Transcribed": 2, "Error": 1}
+    transcribed = sorted(call.args[0] for call in mock_transcribe_audio.call_args_list)
+    assert transcribed == ["local/a.mp3", "local/c.MP3", "local/d.wav"]
@@ -0,0 +1,75 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from utils.cache_utils import SQLiteCache, hash_text, write_atomically
+
+
+def test_hash_text():
+    assert hash_text("question") == hash_text("question")
+    assert hash_text("question") != hash_text("other question")
+
+
+def test_write_atomically(tmp_path):
+    file_path = tmp_path / "file.bin"
+    file_path.write_bytes(b"old")
+
+    def failing_chunks():
+        yield b"partial"
+        raise IOError("connection reset")
+
+    with pytest.raises(IOError):
+        write_atomically(str(file_path), failing_chunks())
+    assert file_path.read_bytes() == b"old"
+    assert os.listdir(tmp_path) == ["file.bin"]
+
+    write_atomically(str(file_path), [b"new ", b"content"])
+    assert file_path.read_bytes() == b"new content"
+
+
+def test_cache_get_set(tmp_path):
+    cache = SQLiteCache(os.path.join(tmp_path, "cache.sqlite3"))
+    assert cache.get("key") is None
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+    assert stats["bytes"] == len("value")
+
+
+def test_cache_persists_between_instances(tmp_path):
+    path = os.path.join(tmp_path, "cache.sqlite3")
+    SQLiteCache(path).set("key", "value")
+    assert SQLiteCache(path).get("key") == "value"
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = SQLiteCache(os.path.join(tmp_path, "cache.sqlite3"), max_bytes=10)
+    with patch("utils.cache_utils.time.time") as mock_time:
+        mock_time.return_value = 1
+        cache.set("a", "12345")
+        mock_time.return_value = 2
+        cache.set("b", "12345")
+        mock_time.return_value = 3
+        assert cache.get("a") == "12345"
+        mock_time.return_value = 4
+        cache.set("c", "12345")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == "12345"
+        assert cache.get("c") == "12345"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_expires_old_entries(tmp_path):
+    cache = SQLiteCache(os.path.join(tmp_path, "cache.sqlite3"), max_age_seconds=60)
+    with patch("utils.cache_utils.time.time") as mock_time:
+        mock_time.return_value = 0
+        cache.set("key", "value")
+        mock_time.return_value = 30
+        assert cache.get("key") == "value"
+        mock_time.return_value = 120
+        assert cache.get("key") is None
@@ -0,0 +1,248 @@
+import os
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects import postgresql
+
+from dataset_setup import data_loader
+from dataset_setup.data_loader import (
+    bulk_load_test_cases,
+    flatten_annotator_metadata,
+    list_dataset_files,
+    load_datasets_from_filesystem,
+    stream_datasets_from_filesystem,
+    parse_annotator_metadata,
+    upsert_test_cases,
+)
+from models import create_tables
+
+METADATA = {
+    "Steps": "1. Searched \"GAIA\" on Google\n2. Read the paper's abstract",
+    "Number of steps": "2",
+    "How long did this take?": "5 minutes",
+    "Tools": "1. Web browser",
+    "Number of tools": "1",
+}
+
+
+def test_parse_annotator_metadata():
+    assert parse_annotator_metadata(str(METADATA)) == METADATA
+    assert parse_annotator_metadata(METADATA) == METADATA
+    assert parse_annotator_metadata('{"Steps": "1. Step", "Tools": "None"}') == {"Steps": "1. Step", "Tools": "None"}
+    assert parse_annotator_metadata("not metadata") is None
+    assert parse_annotator_metadata(float("nan")) is None
+
+
+def test_flatten_annotator_metadata():
+    dataset_df = pd.DataFrame(
+        {
+            "task_id": ["task-1", "task-2", "task-3"],
+            "question": ["q1", "q2", "q3"],
+            "annotator_metadata": [str(METADATA), "{broken", str({"Steps": "1. Step"})],
+        }
+    )
+
+    flattened_dataset_df = flatten_annotator_metadata(dataset_df)
+
+    assert list(flattened_dataset_df.columns) == [
+        "task_id",
+        "question",
+        "metadata_steps",
+        "metadata_num_steps",
+        "metadata_time_taken",
+        "metadata_tools",
+        "metadata_num_tools",
+    ]
+    assert flattened_dataset_df["task_id"].tolist() == ["task-1"]
+    assert flattened_dataset_df.loc[0, "metadata_steps"] == METADATA["Steps"]
+    assert flattened_dataset_df.loc[0, "metadata_num_tools"] == "1"
+
+
+def _cleaned_dataset(rows: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "task_id": [f"task-{i}" for i in range(rows)],
+            "question": [f"question {i}, with a comma\nand a new line" for i in range(rows)],
+            "level": [1] * rows,
+            "answer": ["42"] * rows,
+            "file_name": [None] * rows,
+            "file_path": [None] * rows,
+            "metadata_steps": ["1. Step"] * rows,
+            "metadata_num_steps": ["1"] * rows,
+            "metadata_time_taken": ["1 minute"] * rows,
+            "metadata_tools": ["None"] * rows,
+            "metadata_num_tools": pd.array([None] + [0] * (rows - 1), dtype="Int64"),
+        }
+    )
+
+
+def test_bulk_load_test_cases_with_executemany():
+    engine = create_engine("sqlite://")
+    create_tables(engine)
+
+    with engine.begin() as connection:
+        assert bulk_load_test_cases(connection, _cleaned_dataset(3)) == 3
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text('SELECT "index", task_id, question, metadata_num_tools, created_at FROM test_cases ORDER BY "index"')
+        ).all()
+    assert [row.task_id for row in rows] == ["task-0", "task-1", "task-2"]
+    assert rows[0].question == "question 0, with a comma\nand a new line"
+    assert rows[0].metadata_num_tools is None
+    assert all(row.created_at is not None for row in rows)
+
+
+def test_bulk_load_test_cases_with_copy():
+    connection = MagicMock()
+    connection.dialect = postgresql.psycopg2.dialect()
+    copied_chunks = []
+    cursor = connection.connection.cursor.return_value
+    cursor.copy_expert.side_effect = lambda sql, buffer: copied_chunks.append((sql, buffer.read()))
+
+    dataset_df = _cleaned_dataset(5)
+    dataset_df.loc[1, "metadata_tools"] = ""
+
+    assert bulk_load_test_cases(connection, dataset_df, chunk_size=2) == 5
+
+    assert len(copied_chunks) == 3
+    copy_sql = copied_chunks[0][0]
+    assert copy_sql.startswith('COPY test_cases (index, task_id, question,')
+    assert copy_sql.endswith("FROM STDIN WITH (FORMAT csv, NULL '\\N')")
+    assert copied_chunks[0][1].startswith('0,task-0,"question 0, with a comma\nand a new line",1,42,\\N,\\N,')
+    # Missing values are written as \N, empty strings as empty fields
+    assert ',1 minute,,0,' in copied_chunks[0][1].splitlines()[-1]
+    connection.execute.assert_not_called()
+    cursor.close.assert_called_once()
+
+
+def test_upsert_test_cases():
+    engine = create_engine("sqlite://")
+    create_tables(engine)
+
+    with engine.begin() as connection:
+        assert upsert_test_cases(connection, _cleaned_dataset(3)) == {"inserted": 3, "updated": 0, "unchanged": 0}
+    with engine.connect() as connection:
+        first_load = {row.task_id: row for row in connection.execute(text("SELECT * FROM test_cases")).all()}
+
+    updated_dataset = _cleaned_dataset(4)
+    updated_dataset.loc[1, "answer"] = "43"
+    with engine.begin() as connection:
+        assert upsert_test_cases(connection, updated_dataset) == {"inserted": 1, "updated": 1, "unchanged": 2}
+    with engine.connect() as connection:
+        second_load = {row.task_id: row for row in connection.execute(text("SELECT * FROM test_cases")).all()}
+
+    assert len(second_load) == 4
+    assert second_load["task-1"].answer == "43"
+    assert second_load["task-1"].created_at == first_load["task-1"].created_at
+    assert second_load["task-1"].modified_at > first_load["task-1"].modified_at
+    assert second_load["task-0"].modified_at == first_load["task-0"].modified_at
+
+    with engine.begin() as connection:
+        assert upsert_test_cases(connection, updated_dataset) == {"inserted": 0, "updated": 0, "unchanged": 4}
+
+
+def test_upsert_test_cases_reads_only_the_chunk_hashes(monkeypatch):
+    monkeypatch.setattr(data_loader, "TASK_ID_LOOKUP_CHUNK_SIZE", 2)
+    engine = create_engine("sqlite://")
+    create_tables(engine)
+    with engine.begin() as connection:
+        upsert_test_cases(connection, _cleaned_dataset(4))
+
+    lookups = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record_lookup(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT"):
+            lookups.append(parameters)
+
+    with engine.begin() as connection:
+        summary = upsert_test_cases(connection, _cleaned_dataset(4).iloc[1:])
+
+    assert summary == {"inserted": 0, "updated": 0, "unchanged": 3}
+    assert lookups == [("task-1", "task-2"), ("task-3",)]
+
+
+def test_create_tables_adds_missing_columns():
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE test_cases (task_id VARCHAR(36) PRIMARY KEY, question VARCHAR(2100))"))
+
+    create_tables(engine)
+
+    with engine.connect() as connection:
+        columns = [row[1] for row in connection.execute(text("PRAGMA table_info(test_cases)")).all()]
+    assert "content_hash" in columns
+    assert "modified_at" in columns
+
+
+def _write_dataset_csv(path, task_ids):
+    pd.DataFrame(
+        {
+            "task_id": task_ids,
+            "Question": [f"question {task_id}" for task_id in task_ids],
+            "Level": [1] * len(task_ids),
+            "Final answer": ["42"] * len(task_ids),
+            "file_name": ["file.pdf"] * len(task_ids),
+            "file_path": [""] * len(task_ids),
+            "Annotator Metadata": [str(METADATA)] * len(task_ids),
+        }
+    ).to_csv(path, index=False)
+
+
+@pytest.fixture
+def dataset_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    validation_directory = tmp_path / "resources/datasets/validation"
+    validation_directory.mkdir(parents=True)
+    _write_dataset_csv(validation_directory / "2023_all.csv", [f"a-{i}" for i in range(5)])
+    _write_dataset_csv(validation_directory / "2024_all.csv", [f"b-{i}" for i in range(3)])
+    return tmp_path
+
+
+def test_list_dataset_files_prefers_most_recent_export(dataset_files):
+    validation_directory = dataset_files / "resources/datasets/validation"
+    pd.read_csv(validation_directory / "2023_all.csv").to_parquet(validation_directory / "2023_all.parquet")
+    pd.read_csv(validation_directory / "2024_all.csv").to_parquet(validation_directory / "2024_all.parquet")
+    # The 2024 CSV was exported after its Parquet file
+    csv_mtime = (validation_directory / "2024_all.parquet").stat().st_mtime + 60
+    os.utime(validation_directory / "2024_all.csv", (csv_mtime, csv_mtime))
+
+    assert list_dataset_files() == [
+        "resources/datasets/validation/2023_all.parquet",
+        "resources/datasets/validation/2024_all.csv",
+    ]
+
+
+def test_load_datasets_from_filesystem(dataset_files):
+    cleaned_datasets = load_datasets_from_filesystem(max_workers=2, chunk_size=2)
+
+    assert list(cleaned_datasets) == [
+        "resources/datasets/validation/2023_all.csv",
+        "resources/datasets/validation/2024_all.csv",
+    ]
+    first_dataset = cleaned_datasets["resources/datasets/validation/2023_all.csv"]
+    assert first_dataset["task_id"].tolist() == [f"a-{i}" for i in range(5)]
+    assert first_dataset.index.tolist() == list(range(5))
+    assert first_dataset["file_path"].tolist() == ["damg7374-a1-store/file.pdf"] * 5
+
+    # One cleaned output per input
+    for name, rows in [("2023_all", 5), ("2024_all", 3)]:
+        cleaned_output = pd.read_csv(dataset_files / f"resources/cleaned_datasets/{name}.csv")
+        assert len(cleaned_output) == rows
+        assert "metadata_steps" in cleaned_output.columns
+
+
+def test_stream_datasets_from_filesystem(dataset_files):
+    chunks = list(stream_datasets_from_filesystem(chunk_size=2))
+
+    assert [(name.split("/")[-1], len(chunk)) for name, chunk in chunks] == [
+        ("2023_all.csv", 2),
+        ("2023_all.csv", 2),
+        ("2023_all.csv", 1),
+        ("2024_all.csv", 2),
+        ("2024_all.csv", 1),
+    ]
+    assert chunks[2][1].index.tolist() == [4]
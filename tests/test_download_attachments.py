@@ -0,0 +1,103 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from dataset_setup.download_attachments import download_files, load_manifest
+
+
+class StandInRawFileHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for raw.githubusercontent.com, serving `server.files` with ETags and honouring If-None-Match.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        file_name = self.path.split("/")[-1]
+        content = self.server.files.get(file_name)
+        if content is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        etag = f'"{hashlib.md5(content).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.server.bodies_sent.append(file_name)
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def stand_in_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInRawFileHandler)
+    server.files = {"a.txt": b"first file", "b.pdf": os.urandom(3 * 1024 * 1024)}
+    server.bodies_sent = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _raw_base_url(server):
+    return f"http://127.0.0.1:{server.server_port}/raw/"
+
+
+def test_download_files(stand_in_server, tmp_path):
+    summary = download_files(["a.txt", "b.pdf", "missing.png"], _raw_base_url(stand_in_server), str(tmp_path), 4)
+
+    assert summary["downloaded"] == 2
+    assert summary["failed"] == 1
+    assert summary["bytes"] == len(stand_in_server.files["a.txt"]) + len(stand_in_server.files["b.pdf"])
+    for file_name in ["a.txt", "b.pdf"]:
+        assert (tmp_path / file_name).read_bytes() == stand_in_server.files[file_name]
+    assert not (tmp_path / "missing.png").exists()
+    assert not list(tmp_path.glob("*.part"))
+    assert load_manifest(str(tmp_path))["a.txt"]["size"] == len(stand_in_server.files["a.txt"])
+
+
+def test_download_files_skips_unchanged_files(stand_in_server, tmp_path):
+    download_files(["a.txt", "b.pdf"], _raw_base_url(stand_in_server), str(tmp_path))
+    stand_in_server.bodies_sent.clear()
+    stand_in_server.files["b.pdf"] = b"updated"
+
+    summary = download_files(["a.txt", "b.pdf"], _raw_base_url(stand_in_server), str(tmp_path))
+
+    assert summary["skipped"] == 1
+    assert summary["downloaded"] == 1
+    assert stand_in_server.bodies_sent == ["b.pdf"]
+    assert (tmp_path / "b.pdf").read_bytes() == b"updated"
+
+
+def test_download_files_updates_changed_files_of_the_same_size(stand_in_server, tmp_path):
+    stand_in_server.files["a.txt"] = b"AAAA"
+    download_files(["a.txt"], _raw_base_url(stand_in_server), str(tmp_path))
+    stand_in_server.files["a.txt"] = b"BBBB"
+
+    for _ in range(2):
+        download_files(["a.txt"], _raw_base_url(stand_in_server), str(tmp_path))
+        assert (tmp_path / "a.txt").read_bytes() == b"BBBB"
+    assert load_manifest(str(tmp_path))["a.txt"]["etag"] == f'"{hashlib.md5(b"BBBB").hexdigest()}"'
+
+
+def test_download_files_skips_existing_files_with_matching_size(stand_in_server, tmp_path):
+    # Files scraped before validators were recorded are kept if their size matches
+    (tmp_path / "a.txt").write_bytes(b"first file")
+
+    summary = download_files(["a.txt"], _raw_base_url(stand_in_server), str(tmp_path))
+
+    assert summary["skipped"] == 1
+    assert load_manifest(str(tmp_path))["a.txt"]["etag"] is not None
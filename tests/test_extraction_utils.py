@@ -0,0 +1,96 @@
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pytest
+
+from utils import extraction_utils
+from utils.cache_utils import SQLiteCache
+from utils.extraction_utils import extract_text, is_extractable
+from utils.file_system_utils import Attachment
+from utils.openai_utils import get_openai_response_with_attachments
+
+
+@pytest.fixture(autouse=True)
+def extraction_cache(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "extracted_text.sqlite3"))
+    with patch.object(extraction_utils, "get_extraction_cache", return_value=cache):
+        yield cache
+
+
+def test_is_extractable():
+    assert is_extractable("bucket/table.CSV")
+    assert is_extractable("bucket/script.py")
+    assert not is_extractable("bucket/document.pdf")
+
+
+def test_extract_csv(tmp_path):
+    file_path = tmp_path / "table.csv"
+    file_path.write_text("name,count\napples, 3\npears,5\n")
+    assert extract_text(str(file_path)) == "name,count\napples,3\npears,5\n"
+
+
+def test_extract_xlsx(tmp_path):
+    file_path = tmp_path / "table.xlsx"
+    with pd.ExcelWriter(file_path) as writer:
+        pd.DataFrame({"name": ["apples", "pears"], "count": [3, 5]}).to_excel(writer, sheet_name="Fruits", index=False)
+        pd.DataFrame({"total": [8]}).to_excel(writer, sheet_name="Totals", index=False)
+    assert extract_text(str(file_path)) == "Sheet: Fruits\nname,count\napples,3\npears,5\n\nSheet: Totals\ntotal\n8\n"
+
+
+def test_extract_text_is_cached(tmp_path, extraction_cache):
+    file_path = tmp_path / "notes.txt"
+    file_path.write_text("some notes")
+    assert extract_text(str(file_path)) == "some notes"
+
+    with patch.object(extraction_utils, "_read_text") as mock_read_text:
+        assert extract_text(str(file_path)) == "some notes"
+    mock_read_text.assert_not_called()
+    assert extraction_cache.stats()["hits"] == 1
+
+
+def test_extract_text_failure_returns_none(tmp_path):
+    file_path = tmp_path / "table.xlsx"
+    file_path.write_bytes(b"not a spreadsheet")
+    assert extract_text(str(file_path)) is None
+    assert extract_text(str(tmp_path / "missing.txt")) is None
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "openai_responses.sqlite3"))
+    with patch("utils.openai_utils.get_response_cache", return_value=cache):
+        yield cache
+
+
+@patch("utils.openai_utils._invoke_other_assistants", return_value="assistants answer")
+@patch("utils.openai_utils.get_rate_limited_client")
+@patch("utils.openai_utils.load_file")
+def test_small_attachment_is_inlined(mock_load_file, mock_get_rate_limited_client, mock_invoke_other_assistants, tmp_path, response_cache):
+    file_path = tmp_path / "table.csv"
+    file_path.write_text("name,count\napples,3\n")
+    mock_load_file.return_value = Attachment(str(file_path))
+    completion = MagicMock()
+    completion.choices[0].message.content = "3"
+    mock_get_rate_limited_client.return_value.chat.completions.create.return_value = completion
+
+    assert get_openai_response_with_attachments("How many apples?", "gpt-4o", "bucket/table.csv") == "3"
+
+    mock_load_file.assert_called_once_with("bucket/table.csv", prefer_picture=False)
+    mock_invoke_other_assistants.assert_not_called()
+    prompt = mock_get_rate_limited_client.return_value.chat.completions.create.call_args.kwargs["messages"][-1]["content"]
+    assert "apples,3" in prompt
+
+
+@patch("utils.openai_utils._invoke_other_assistants", return_value="assistants answer")
+@patch("utils.openai_utils.get_rate_limited_client")
+@patch("utils.openai_utils.load_file")
+def test_oversized_attachment_uses_assistants(mock_load_file, mock_get_rate_limited_client, mock_invoke_other_assistants, tmp_path, response_cache, monkeypatch):
+    monkeypatch.setenv("OPENAI_INLINE_ATTACHMENT_MAX_TOKENS", "10")
+    file_path = tmp_path / "notes.txt"
+    file_path.write_text("a long document " * 100)
+    mock_load_file.return_value = Attachment(str(file_path))
+
+    assert get_openai_response_with_attachments("Summarize", "gpt-4o", "bucket/notes.txt") == "assistants answer"
+
+    mock_get_rate_limited_client.return_value.chat.completions.create.assert_not_called()
+    mock_invoke_other_assistants.assert_called_once()
@@ -1,17 +1,30 @@
+import glob
+import io
+import tempfile
+import time
 import unittest
-from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock, ANY
 import os
 import boto3
 from botocore.exceptions import ClientError
+from PIL import Image
+
+from utils.attachment_cache import AttachmentCache
 
 # Import the functions to be tested
 from utils.file_system_utils import (
     load_aws_tokens,
     load_s3_bucket,
     get_s3_client,
+    _create_s3_client,
     load_file,
+    Attachment,
     read_file_contents,
     download,
+    prefetch_files,
+    get_attachment_cache,
+    preprocess_image,
     LOCAL_CACHE_DIRECTORY,
     FILE_FORMATS_WITH_PICTURES
 )
@@ -53,35 +66,62 @@ class TestS3Functions(unittest.TestCase):
 
     @patch('boto3.client')
     def test_get_s3_client(self, mock_boto3_client):
+        _create_s3_client.cache_clear()
         mock_client = MagicMock()
         mock_boto3_client.return_value = mock_client
         client = get_s3_client()
         self.assertEqual(client, mock_client)
-        mock_boto3_client.assert_called_once_with('s3', **load_aws_tokens())
+        self.assertEqual(get_s3_client(), mock_client)
+        mock_boto3_client.assert_called_once_with('s3', config=ANY, **load_aws_tokens())
+        self.assertEqual(mock_boto3_client.call_args.kwargs['config'].max_pool_connections, 32)
+        _create_s3_client.cache_clear()
 
-    @patch('os.path.exists')
+    @patch('utils.file_system_utils.get_attachment_cache')
     @patch('utils.file_system_utils.download')
     @patch('utils.file_system_utils.read_file_contents')
-    def test_load_file(self, mock_read_contents, mock_download, mock_exists):
-        mock_exists.return_value = True
+    def test_load_file(self, mock_read_contents, mock_download, mock_get_attachment_cache):
+        mock_cache = mock_get_attachment_cache.return_value
+        mock_cache.lookup.return_value = 'cache/test_file.txt'
+        mock_cache.path.return_value = 'cache/test_file.txt'
         mock_read_contents.return_value = b'test content'
-        content, path = load_file('test_file.txt')
-        self.assertEqual(content, b'test content')
-        self.assertTrue(path.endswith('test_file.txt'))
+        attachment = load_file('test_file.txt')
+        self.assertTrue(attachment.path.endswith('test_file.txt'))
+        mock_read_contents.assert_not_called()
+        self.assertEqual(attachment.read(), b'test content')
         mock_download.assert_not_called()
+        mock_cache.pin.assert_called_once_with('test_file.txt')
+        with attachment:
+            mock_cache.unpin.assert_not_called()
+        mock_cache.unpin.assert_called_once_with('test_file.txt')
 
-    @patch('os.path.exists')
+    @patch('utils.file_system_utils.get_attachment_cache')
     @patch('utils.file_system_utils.download')
     @patch('utils.file_system_utils.read_file_contents')
-    def test_load_file_with_pictures(self, mock_read_contents, mock_download, mock_exists):
-        mock_exists.side_effect = [False, True]  # First call returns False, second call returns True
+    def test_load_file_with_pictures(self, mock_read_contents, mock_download, mock_get_attachment_cache):
+        mock_cache = mock_get_attachment_cache.return_value
+        mock_cache.lookup.return_value = None
+        mock_cache.path.side_effect = lambda name: os.path.join('cache', name)
         mock_download.return_value = True
         mock_read_contents.return_value = b'png content'
-        content, path = load_file('test_file.xlsx')
-        self.assertEqual(content, b'png content')
-        self.assertTrue(path.endswith('test_file.png'))
+        attachment = load_file('test_file.xlsx')
+        self.assertEqual(attachment.read(), b'png content')
+        self.assertTrue(attachment.path.endswith('test_file.png'))
+        self.assertEqual(attachment.extension, '.png')
         mock_download.assert_called_once_with('test_file.png')
 
+    def test_attachment(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test_file.txt')
+            with open(path, 'wb') as f:
+                f.write(b'file content')
+            attachment = Attachment(path)
+            self.assertEqual(attachment.size, 12)
+            with attachment.open() as f:
+                self.assertEqual(f.read(4), b'file')
+            with attachment.mmap() as buffer:
+                self.assertEqual(buffer[5:], b'content')
+            self.assertEqual(attachment.read(), b'file content')
+
     def test_read_file_contents(self):
         with patch('builtins.open', unittest.mock.mock_open(read_data=b'file content')) as mock_file:
             content = read_file_contents('test_file.txt')
@@ -94,12 +134,20 @@ class TestS3Functions(unittest.TestCase):
         mock_client = MagicMock()
         mock_get_client.return_value = mock_client
         mock_load_bucket.return_value = 'test_bucket'
+        mock_client.get_object.return_value = self._get_object_response(b'content', '"etag1"')
+
+        with tempfile.TemporaryDirectory() as directory, patch('utils.file_system_utils.LOCAL_CACHE_DIRECTORY', directory):
+            result = download('test_file.txt')
 
-        result = download('test_file.txt')
+            self.assertTrue(result)
+            mock_client.get_object.assert_called_once_with(Bucket='test_bucket', Key='test_file.txt')
+            self.assertEqual(read_file_contents(os.path.join(directory, 'test_file.txt')), b'content')
 
-        self.assertTrue(result)
-        mock_client.head_object.assert_called_once_with(Bucket='test_bucket', Key='test_file.txt')
-        mock_client.download_file.assert_called_once()
+            # A cached file is revalidated with its ETag
+            mock_client.get_object.side_effect = ClientError({'Error': {'Code': '304'}}, 'GetObject')
+            self.assertTrue(download('test_file.txt'))
+            mock_client.get_object.assert_called_with(Bucket='test_bucket', Key='test_file.txt', IfNoneMatch='"etag1"')
+            self.assertEqual(read_file_contents(os.path.join(directory, 'test_file.txt')), b'content')
 
     @patch('utils.file_system_utils.get_s3_client')
     @patch('utils.file_system_utils.load_s3_bucket')
@@ -107,13 +155,259 @@ class TestS3Functions(unittest.TestCase):
         mock_client = MagicMock()
         mock_get_client.return_value = mock_client
         mock_load_bucket.return_value = 'test_bucket'
-        mock_client.head_object.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        mock_client.get_object.side_effect = ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+
+        with tempfile.TemporaryDirectory() as directory, patch('utils.file_system_utils.LOCAL_CACHE_DIRECTORY', directory):
+            result = download('non_existent_file.txt')
+
+            self.assertFalse(result)
+            mock_client.get_object.assert_called_once_with(Bucket='test_bucket', Key='non_existent_file.txt')
+            self.assertFalse(os.path.exists(os.path.join(directory, 'non_existent_file.txt')))
+
+    @patch('utils.file_system_utils.get_s3_client')
+    @patch('utils.file_system_utils.load_s3_bucket')
+    def test_concurrent_load_file_downloads_once(self, mock_load_bucket, mock_get_client):
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_load_bucket.return_value = 'test_bucket'
+
+        def slow_get_object(**kwargs):
+            time.sleep(0.1)
+            return self._get_object_response(b'content', '"etag1"')
+
+        mock_client.get_object.side_effect = slow_get_object
+
+        with tempfile.TemporaryDirectory() as directory, patch('utils.file_system_utils.LOCAL_CACHE_DIRECTORY', directory):
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                attachments = list(executor.map(load_file, ['bucket/shared.txt'] * 8))
+
+            mock_client.get_object.assert_called_once()
+            self.assertTrue(all(attachment.read() == b'content' for attachment in attachments))
+            self.assertEqual([name for name in os.listdir(directory) if name.endswith('.part')], [])
+
+    @patch('utils.file_system_utils.get_s3_client')
+    @patch('utils.file_system_utils.load_s3_bucket')
+    def test_download_links_identical_content(self, mock_load_bucket, mock_get_client):
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_load_bucket.return_value = 'test_bucket'
+
+        with tempfile.TemporaryDirectory() as directory, patch('utils.file_system_utils.LOCAL_CACHE_DIRECTORY', directory):
+            mock_client.get_object.return_value = self._get_object_response(b'content', '"etag1"')
+            self.assertTrue(download('bucket-a/first.txt'))
+            response = self._get_object_response(b'content', '"etag1"')
+            mock_client.get_object.return_value = response
+            self.assertTrue(download('bucket-b/second.txt'))
+
+            response['Body'].iter_chunks.assert_not_called()
+            self.assertTrue(os.path.samefile(
+                os.path.join(directory, 'bucket-a', 'first.txt'), os.path.join(directory, 'bucket-b', 'second.txt')
+            ))
+            self.assertEqual(get_attachment_cache().stats()['bytes'], len(b'content'))
+
+    @staticmethod
+    def _get_object_response(content, etag):
+        body = MagicMock()
+        body.iter_chunks.return_value = [content]
+        return {'Body': body, 'ETag': etag}
+
+class TestPrefetchFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_directory_patch = patch('utils.file_system_utils.LOCAL_CACHE_DIRECTORY', self.directory.name)
+        self.cache_directory_patch.start()
+
+    def tearDown(self):
+        self.cache_directory_patch.stop()
+        self.directory.cleanup()
+
+    def _download(self, key):
+        if 'missing' in key:
+            return False
+        self._write_cached_file(key, key.encode())
+        return True
+
+    def _write_cached_file(self, name, content):
+        os.makedirs(os.path.join(self.directory.name, os.path.dirname(name)), exist_ok=True)
+        with open(os.path.join(self.directory.name, name), 'wb') as f:
+            f.write(content)
+        get_attachment_cache().record(name)
+
+    @patch('utils.file_system_utils.download')
+    def test_prefetch_files(self, mock_download):
+        mock_download.side_effect = self._download
+        self._write_cached_file('bucket/cached.pdf', b'cached')
+
+        summary = prefetch_files(
+            ['bucket/a.pdf', 'bucket/a.pdf', 'bucket/b.xlsx', 'bucket/cached.pdf', 'bucket/missing.txt']
+        )
+
+        self.assertEqual(summary['downloaded'], 2)
+        self.assertEqual(summary['cached'], 1)
+        self.assertEqual(summary['failed'], 1)
+        # Both the picture and the source of the spreadsheet are fetched
+        self.assertEqual(summary['bytes'], len(b'bucket/a.pdf') + len(b'bucket/b.png') + len(b'bucket/b.xlsx'))
+        downloaded_keys = sorted(call.args[0] for call in mock_download.call_args_list)
+        self.assertEqual(downloaded_keys, ['bucket/a.pdf', 'bucket/b.png', 'bucket/b.xlsx', 'bucket/missing.txt'])
+
+
+class TestAttachmentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = AttachmentCache(self.directory.name, max_bytes=10)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write(self, name, content):
+        with open(os.path.join(self.directory.name, name), 'wb') as f:
+            f.write(content)
+
+    def test_unrecorded_file_is_a_miss(self):
+        # A file without manifest entry, e.g. left over by an interrupted download
+        self._write('partial.pdf', b'123')
+        self.assertIsNone(self.cache.lookup('partial.pdf'))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_lookup_recorded_file(self):
+        self._write('a.pdf', b'123')
+        self.cache.record('a.pdf', '"etag"')
+        self.assertEqual(self.cache.lookup('a.pdf'), os.path.join(self.directory.name, 'a.pdf'))
+        self.assertEqual(self.cache.etag('a.pdf'), '"etag"')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_corrupted_file_is_dropped(self):
+        self._write('a.pdf', b'123')
+        self.cache.record('a.pdf')
+        self._write('a.pdf', b'12')
+        self.assertIsNone(self.cache.lookup('a.pdf'))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'a.pdf')))
+        self.assertEqual(self.cache.stats()['corruptions'], 1)
+
+    def test_least_recently_used_files_are_evicted(self):
+        for name in ['a.pdf', 'b.pdf']:
+            self._write(name, name[0].encode() * 4)
+            self.cache.record(name)
+        self.cache.lookup('a.pdf')
+        self._write('c.pdf', b'cccc')
+        self.cache.record('c.pdf')
+
+        self.assertIsNone(self.cache.lookup('b.pdf'))
+        self.assertIsNotNone(self.cache.lookup('a.pdf'))
+        self.assertIsNotNone(self.cache.lookup('c.pdf'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(self.cache.stats()['bytes'], 8)
+
+    def test_locked_files_are_not_evicted(self):
+        for name in ['a.pdf', 'b.pdf']:
+            self._write(name, name[0].encode() * 4)
+            self.cache.record(name)
+        # a.pdf is the least recently used, but is being downloaded again
+        with self.cache.lock('a.pdf'):
+            self._write('c.pdf', b'cccc')
+            self.cache.record('c.pdf')
+
+        self.assertIsNotNone(self.cache.lookup('a.pdf'))
+        self.assertIsNone(self.cache.lookup('b.pdf'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_pinned_files_are_not_evicted(self):
+        for name in ['a.pdf', 'b.pdf']:
+            self._write(name, name[0].encode() * 4)
+            self.cache.record(name)
+        # a.pdf is the least recently used, but is in use by a reader
+        self.cache.pin('a.pdf')
+        self._write('c.pdf', b'cccc')
+        self.cache.record('c.pdf')
+
+        self.assertTrue(self.cache.contains('a.pdf'))
+        self.assertFalse(self.cache.contains('b.pdf'))
+
+        self.cache.unpin('a.pdf')
+        self._write('d.pdf', b'dddd')
+        self.cache.record('d.pdf')
+        self.assertFalse(self.cache.contains('a.pdf'))
+
+    def test_derived_files_count_toward_budget(self):
+        self._write('a.png', b'aaaa')
+        self.cache.record('a.png')
+        self._write('a.preprocessed.jpg', b'1234')
+        self._write('b.pdf', b'bbbb')
+        self.cache.record('b.pdf')
+
+        self.assertIsNone(self.cache.lookup('a.png'))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'a.preprocessed.jpg')))
+        self.assertIsNotNone(self.cache.lookup('b.pdf'))
+
+    def test_changed_content_drops_derived_files(self):
+        self._write('a.png', b'aaaa')
+        self.cache.record('a.png')
+        self._write('b.png', b'bbbb')
+        self.cache.record('b.png', '"etag-b"')
+        self._write('a.preprocessed.jpg', b'aa')
+        # a.png now has the content of b.png, whose object is older than the preprocessed image of a.png
+        self.cache.link('a.png', self.cache.find_object('"etag-b"'), '"etag-b"')
+
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'a.preprocessed.jpg')))
+        self.assertTrue(self.cache.contains('a.png'))
+
+    def test_identical_files_share_one_object(self):
+        self._write('a.pdf', b'1234')
+        self.cache.record('a.pdf')
+        self._write('b.pdf', b'1234')
+        self.cache.record('b.pdf')
+
+        a_path, b_path = self.cache.lookup('a.pdf'), self.cache.lookup('b.pdf')
+        self.assertTrue(os.path.samefile(a_path, b_path))
+        self.assertEqual(self.cache.stats()['entries'], 2)
+        self.assertEqual(self.cache.stats()['bytes'], 4)
+
+        # The object is only removed with the last name linked to it
+        for name, content in [('c.pdf', b'5678'), ('d.pdf', b'9abc')]:
+            self._write(name, content)
+            self.cache.record(name)
+        self.assertIsNone(self.cache.lookup('a.pdf'))
+        self.assertIsNone(self.cache.lookup('b.pdf'))
+        self.assertEqual(len(glob.glob(os.path.join(self.directory.name, 'objects', '*', '*'))), 2)
+
+
+class TestPreprocessImage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _save_image(self, name, image):
+        path = os.path.join(self.directory.name, name)
+        image.save(path)
+        return path
+
+    def test_preprocess_large_image(self):
+        path = self._save_image('large.png', Image.effect_noise((3000, 2000), 50).convert('RGB'))
+        content, ext = preprocess_image(path)
+        self.assertEqual(ext, '.jpg')
+        self.assertEqual(Image.open(io.BytesIO(content)).size, (1152, 768))
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, 'large.preprocessed.jpg')))
+
+    def test_preprocess_image_uses_cached_result(self):
+        path = self._save_image('large.png', Image.effect_noise((1000, 1000), 50).convert('RGB'))
+        content, _ = preprocess_image(path)
+        with patch('utils.file_system_utils.Image.open') as mock_open:
+            cached_content, ext = preprocess_image(path)
+        mock_open.assert_not_called()
+        self.assertEqual(cached_content, content)
+        self.assertEqual(ext, '.jpg')
 
-        result = download('non_existent_file.txt')
+    def test_preprocess_image_keeps_transparency(self):
+        path = self._save_image('small.png', Image.new('RGBA', (10, 10)))
+        content, ext = preprocess_image(path)
+        self.assertEqual(ext, '.png')
+        self.assertEqual(Image.open(io.BytesIO(content)).mode, 'RGBA')
 
-        self.assertFalse(result)
-        mock_client.head_object.assert_called_once_with(Bucket='test_bucket', Key='non_existent_file.txt')
-        mock_client.download_file.assert_not_called()
 
 if __name__ == '__main__':
     unittest.main()
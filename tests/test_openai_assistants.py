@@ -0,0 +1,228 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import httpx
+import openai
+import pytest
+
+from utils.cache_utils import SQLiteCache, hash_file
+from utils.file_system_utils import Attachment
+from utils.openai_utils import (
+    _ensure_assistant_vector_store,
+    _format_citations,
+    _resolve_file_names,
+    get_openai_response_with_attachments,
+    get_or_upload_file,
+    run_assistant,
+    wait_on_run,
+)
+
+THREAD = SimpleNamespace(id="thread-1")
+
+
+def _run(status: str, run_id: str = "run-1"):
+    return SimpleNamespace(id=run_id, status=status)
+
+
+def _client_with_stream():
+    """
+    Mock client whose rate-limited copy, from `with_options`, opens the mocked event stream.
+    """
+    openai_client = MagicMock()
+    stream_manager = openai_client.with_options.return_value.beta.threads.runs.stream.return_value
+    stream_manager.__exit__.return_value = False
+    return openai_client, stream_manager.__enter__.return_value
+
+
+@patch("utils.openai_utils.time.sleep")
+def test_wait_on_run_backs_off(mock_sleep):
+    openai_client = MagicMock()
+    openai_client.beta.threads.runs.retrieve.side_effect = [_run("in_progress")] * 3 + [_run("completed")]
+
+    run = wait_on_run(openai_client, _run("queued"), THREAD, initial_interval=1, max_interval=2)
+
+    assert run.status == "completed"
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [1, 1.5, 2, 2]
+
+
+def test_run_assistant_streams_run(monkeypatch):
+    monkeypatch.setenv("OPENAI_RUN_MODE", "stream")
+    openai_client, stream = _client_with_stream()
+    stream.get_final_run.return_value = _run("completed")
+
+    assert run_assistant(openai_client, THREAD, "assistant-1", "gpt-4o").status == "completed"
+
+    openai_client.with_options.assert_called_once_with(max_retries=0)
+    stream.until_done.assert_called_once()
+    openai_client.beta.threads.runs.retrieve.assert_not_called()
+
+
+def test_run_assistant_streamed_run_failure(monkeypatch):
+    monkeypatch.setenv("OPENAI_RUN_MODE", "stream")
+    openai_client, stream = _client_with_stream()
+    stream.get_final_run.return_value = _run("failed")
+
+    with pytest.raises(ValueError, match="failed with status: failed"):
+        run_assistant(openai_client, THREAD, "assistant-1", "gpt-4o")
+
+
+@patch("utils.openai_utils.time.sleep")
+def test_run_assistant_falls_back_to_polling(mock_sleep, monkeypatch):
+    monkeypatch.setenv("OPENAI_RUN_MODE", "stream")
+    openai_client, stream = _client_with_stream()
+    stream.until_done.side_effect = openai.APIConnectionError(request=httpx.Request("GET", "https://api.openai.com"))
+    stream.current_run = _run("in_progress")
+    openai_client.beta.threads.runs.retrieve.return_value = _run("completed")
+
+    assert run_assistant(openai_client, THREAD, "assistant-1", "gpt-4o").status == "completed"
+
+    # The run is polled with the retrying client
+    openai_client.beta.threads.runs.retrieve.assert_called_once_with(thread_id="thread-1", run_id="run-1")
+
+
+def test_run_assistant_interrupted_before_run_is_created(monkeypatch):
+    monkeypatch.setenv("OPENAI_RUN_MODE", "stream")
+    openai_client, stream = _client_with_stream()
+    stream.until_done.side_effect = openai.APIConnectionError(request=httpx.Request("GET", "https://api.openai.com"))
+    stream.current_run = None
+
+    with pytest.raises(openai.APIConnectionError):
+        run_assistant(openai_client, THREAD, "assistant-1", "gpt-4o")
+
+
+@patch("utils.openai_utils.time.sleep")
+def test_run_assistant_poll_mode(mock_sleep, monkeypatch):
+    monkeypatch.setenv("OPENAI_RUN_MODE", "poll")
+    openai_client = MagicMock()
+    openai_client.with_options.return_value.beta.threads.runs.create.return_value = _run("queued")
+    openai_client.beta.threads.runs.retrieve.return_value = _run("completed")
+
+    assert run_assistant(openai_client, THREAD, "assistant-1", "gpt-4o").status == "completed"
+
+    openai_client.with_options.return_value.beta.threads.runs.stream.assert_not_called()
+    mock_sleep.assert_called_once()
+
+
+@pytest.fixture
+def file_registry(tmp_path):
+    registry = SQLiteCache(str(tmp_path / "openai_files.sqlite3"))
+    with patch("utils.openai_utils.get_file_registry", return_value=registry), patch(
+        "utils.openai_utils._validated_file_ids", set()
+    ):
+        yield registry
+
+
+@pytest.fixture
+def attachment(tmp_path):
+    file_path = tmp_path / "document.pdf"
+    file_path.write_bytes(b"document content")
+    return str(file_path)
+
+
+def test_get_or_upload_file_uploads_once(file_registry, attachment):
+    openai_client = MagicMock()
+    openai_client.files.create.return_value = SimpleNamespace(id="file-1")
+
+    assert get_or_upload_file(openai_client, attachment) == "file-1"
+    assert get_or_upload_file(openai_client, attachment) == "file-1"
+
+    openai_client.files.create.assert_called_once()
+    # The uploaded file id is known to exist in this process
+    openai_client.files.retrieve.assert_not_called()
+    assert file_registry.get(hash_file(attachment)) == "file-1"
+
+
+def test_get_or_upload_file_registry_hit(file_registry, attachment):
+    file_registry.set(hash_file(attachment), "file-1")
+    openai_client = MagicMock()
+
+    assert get_or_upload_file(openai_client, attachment) == "file-1"
+    assert get_or_upload_file(openai_client, attachment) == "file-1"
+
+    # The registered file id is validated once per process
+    openai_client.files.retrieve.assert_called_once_with("file-1")
+    openai_client.files.create.assert_not_called()
+
+
+def test_get_or_upload_file_uploads_again_when_deleted(file_registry, attachment):
+    file_registry.set(hash_file(attachment), "file-1")
+    openai_client = MagicMock()
+    openai_client.files.retrieve.side_effect = openai.NotFoundError(
+        "No such file",
+        response=httpx.Response(404, request=httpx.Request("GET", "https://api.openai.com")),
+        body=None,
+    )
+    openai_client.files.create.return_value = SimpleNamespace(id="file-2")
+
+    assert get_or_upload_file(openai_client, attachment) == "file-2"
+
+    openai_client.files.create.assert_called_once()
+    assert file_registry.get(hash_file(attachment)) == "file-2"
+
+
+@patch("utils.openai_utils.get_openai_client")
+def test_ensure_assistant_vector_store_is_memoized(mock_get_openai_client):
+    _ensure_assistant_vector_store.cache_clear()
+    openai_client = mock_get_openai_client.return_value
+    openai_client.beta.assistants.retrieve.return_value.tool_resources.file_search.vector_store_ids = []
+
+    try:
+        _ensure_assistant_vector_store("assistant-1", "vector-store-1")
+        _ensure_assistant_vector_store("assistant-1", "vector-store-1")
+    finally:
+        _ensure_assistant_vector_store.cache_clear()
+
+    openai_client.beta.assistants.retrieve.assert_called_once_with(assistant_id="assistant-1")
+    openai_client.beta.assistants.update.assert_called_once()
+    assert openai_client.beta.assistants.update.call_args.kwargs["tool_resources"] == {
+        "file_search": {"vector_store_ids": ["vector-store-1"]}
+    }
+
+
+def _citation(text: str, file_id: str):
+    return SimpleNamespace(text=text, file_citation=SimpleNamespace(file_id=file_id))
+
+
+@patch("utils.openai_utils._file_names", {})
+def test_resolve_file_names_retrieves_each_file_once():
+    openai_client = MagicMock()
+    openai_client.files.retrieve.side_effect = lambda file_id: SimpleNamespace(filename=f"{file_id}.pdf")
+
+    assert _resolve_file_names(openai_client, {"file-1", "file-2"}) == {"file-1": "file-1.pdf", "file-2": "file-2.pdf"}
+    assert _resolve_file_names(openai_client, {"file-1"}) == {"file-1": "file-1.pdf"}
+
+    assert sorted(call.args[0] for call in openai_client.files.retrieve.call_args_list) == ["file-1", "file-2"]
+
+
+@patch("utils.openai_utils._file_names", {})
+def test_format_citations():
+    openai_client = MagicMock()
+    openai_client.files.retrieve.side_effect = lambda file_id: SimpleNamespace(filename=f"{file_id}.pdf")
+    message = "It is 42 【4:0†source】, as stated twice 【4:0†source】 and in both files 【4:0†source】【4:1†source】."
+    annotations = [
+        _citation("【4:0†source】", "file-1"),
+        _citation("【4:0†source】", "file-1"),
+        _citation("【4:0†source】【4:1†source】", "file-2"),
+    ]
+
+    assert _format_citations(openai_client, message, annotations) == (
+        "It is 42 [0], as stated twice [0] and in both files [2]."
+        "\n\n [0] file-1.pdf\n[1] file-1.pdf\n[2] file-2.pdf"
+    )
+    assert openai_client.files.retrieve.call_count == 2
+
+
+@patch("utils.openai_utils.get_openai_client")
+@patch("utils.openai_utils.load_file")
+def test_unsupported_attachment_is_not_cached(mock_load_file, mock_get_openai_client, tmp_path):
+    file_path = tmp_path / "archive.zip"
+    file_path.write_bytes(b"archive content")
+    mock_load_file.return_value = Attachment(str(file_path))
+    response_cache = SQLiteCache(str(tmp_path / "openai_responses.sqlite3"))
+
+    with patch("utils.openai_utils.get_response_cache", return_value=response_cache):
+        with pytest.raises(ValueError, match="File format .zip is not supported by OpenAI"):
+            get_openai_response_with_attachments("What's in the archive?", "gpt-4o", "bucket/archive.zip")
+
+    assert response_cache.stats()["entries"] == 0
+    mock_get_openai_client.return_value.files.create.assert_not_called()
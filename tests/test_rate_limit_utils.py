@@ -0,0 +1,165 @@
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+import httpx
+import openai
+import pytest
+
+from utils.cache_utils import SQLiteCache
+from utils.openai_utils import get_openai_client, get_openai_response, get_rate_limited_client
+from utils.rate_limit_utils import (
+    DEFAULT_TOKENS_PER_MINUTE,
+    RateLimiter,
+    call_with_rate_limit,
+    get_rate_limiter,
+    get_retry_after,
+    load_rate_limits,
+    estimate_tokens,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    fake_clock = FakeClock()
+    with patch('utils.rate_limit_utils.time.monotonic', fake_clock.monotonic), patch(
+        'utils.rate_limit_utils.time.sleep', fake_clock.sleep
+    ):
+        yield fake_clock
+
+
+def _rate_limit_error(headers=None):
+    response = httpx.Response(429, headers=headers or {}, request=httpx.Request('POST', 'https://api.openai.com'))
+    return openai.RateLimitError('Rate limit reached', response=response, body=None)
+
+
+def test_rate_limiter_requests_per_minute(clock):
+    rate_limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=100000)
+    for _ in range(60):
+        rate_limiter.acquire()
+    assert clock.now == 0
+    rate_limiter.acquire()
+    assert clock.now == pytest.approx(1)
+
+
+def test_rate_limiter_tokens_per_minute(clock):
+    rate_limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=600)
+    rate_limiter.acquire(600)
+    rate_limiter.acquire(300)
+    assert clock.now == pytest.approx(30)
+    assert rate_limiter.queue_depth == 0
+
+
+def test_rate_limiter_pause(clock):
+    rate_limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=100000)
+    rate_limiter.pause(5)
+    rate_limiter.acquire()
+    assert clock.now == pytest.approx(5)
+
+
+def test_rate_limiter_reconcile(clock):
+    rate_limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=600)
+    reserved_tokens = rate_limiter.acquire(600)
+    rate_limiter.reconcile(reserved_tokens, 100)
+    assert rate_limiter.stats()['available_tokens'] == 500
+    rate_limiter.acquire(500)
+    assert clock.now == 0
+
+    # Tokens used beyond the reservation delay the next callers
+    rate_limiter.reconcile(0, 60)
+    rate_limiter.acquire(0)
+    rate_limiter.acquire(60)
+    assert clock.now == pytest.approx(12)
+
+
+def test_get_retry_after():
+    assert get_retry_after(_rate_limit_error({'retry-after-ms': '1500'})) == 1.5
+    assert get_retry_after(_rate_limit_error({'retry-after': '3'})) == 3
+    assert get_retry_after(_rate_limit_error()) is None
+
+
+def test_call_with_rate_limit_retries(clock):
+    invoke = MagicMock(side_effect=[_rate_limit_error({'retry-after': '2'}), 'response'])
+    assert call_with_rate_limit('retry-model', 10, invoke) == 'response'
+    assert invoke.call_count == 2
+    assert clock.now == pytest.approx(2)
+
+
+def test_call_with_rate_limit_retries_transient_errors(clock):
+    request = httpx.Request('POST', 'https://api.openai.com')
+    invoke = MagicMock(
+        side_effect=[
+            openai.APIConnectionError(request=request),
+            openai.APITimeoutError(request=request),
+            openai.InternalServerError('Service unavailable', response=httpx.Response(503, request=request), body=None),
+            'response',
+        ]
+    )
+    with patch('utils.rate_limit_utils.random.random', return_value=0):
+        assert call_with_rate_limit('transient-model', 10, invoke) == 'response'
+    assert invoke.call_count == 4
+    assert clock.now == pytest.approx(1 + 2 + 4)
+
+    # Only the failing call backed off, the other callers of the model aren't paused
+    get_rate_limiter('transient-model').acquire()
+    assert clock.now == pytest.approx(7)
+
+
+def test_call_with_rate_limit_gives_up_on_transient_errors(clock):
+    invoke = MagicMock(side_effect=openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com')))
+    with pytest.raises(openai.APIConnectionError):
+        call_with_rate_limit('unreachable-model', 10, invoke, max_attempts=3)
+    assert invoke.call_count == 3
+
+
+@patch('utils.openai_utils.get_rate_limited_client')
+def test_get_openai_response_connection_error(mock_get_rate_limited_client, clock, tmp_path):
+    mock_get_rate_limited_client.return_value.chat.completions.create.side_effect = openai.APIConnectionError(
+        request=httpx.Request('POST', 'https://api.openai.com')
+    )
+    with patch('utils.openai_utils.get_response_cache', return_value=SQLiteCache(str(tmp_path / 'responses.sqlite3'))):
+        response = get_openai_response('question', 'connection-model')
+    assert response == 'Error invoking OpenAI API: Connection error.'
+
+
+def test_call_with_rate_limit_credits_unused_tokens(clock):
+    response = SimpleNamespace(usage=SimpleNamespace(total_tokens=200))
+    assert call_with_rate_limit('usage-model', 5000, MagicMock(return_value=response)) == response
+    assert get_rate_limiter('usage-model').stats()['available_tokens'] == DEFAULT_TOKENS_PER_MINUTE - 200
+
+
+def test_rate_limited_client_disables_sdk_retries():
+    with patch.dict('os.environ', {'OPENAI_KEY': 'test_key', 'OPENAI_MAX_RETRIES': '3'}):
+        get_openai_client.cache_clear()
+        try:
+            assert get_openai_client().max_retries == 3
+            assert get_rate_limited_client().max_retries == 0
+        finally:
+            get_openai_client.cache_clear()
+
+
+def test_call_with_rate_limit_gives_up(clock):
+    invoke = MagicMock(side_effect=_rate_limit_error({'retry-after': '1'}))
+    with pytest.raises(openai.RateLimitError):
+        call_with_rate_limit('exhausted-model', 10, invoke, max_attempts=3)
+    assert invoke.call_count == 3
+
+
+def test_load_rate_limits():
+    with patch.dict('os.environ', {'OPENAI_RATE_LIMITS': '{"model-a": {"rpm": 5000}}', 'OPENAI_TPM_LIMIT': '2000'}):
+        assert load_rate_limits('model-a') == (5000, 2000)
+        assert load_rate_limits('model-b') == (500, 2000)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('a' * 400, completion_tokens=100) == 200
@@ -0,0 +1,94 @@
+from unittest.mock import MagicMock, patch
+
+import datasets
+import pandas as pd
+import pytest
+
+from dataset_setup import scraper
+from dataset_setup.data_loader import list_dataset_files, load_datasets_from_filesystem
+from dataset_setup.scraper import download_datasets
+
+
+def _gaia_dataset_dict() -> datasets.DatasetDict:
+    return datasets.DatasetDict(
+        {
+            "validation": datasets.Dataset.from_list(
+                [
+                    {
+                        "task_id": "task-1",
+                        "Question": "What's 6 times 7?",
+                        "Level": "1",
+                        "Final answer": "42",
+                        "file_name": "",
+                        "file_path": "",
+                        "Annotator Metadata": {
+                            "Steps": "1. Multiply the numbers, it's easy",
+                            "Number of steps": "1",
+                            "How long did this take?": "1 minute",
+                            "Tools": "None",
+                            "Number of tools": "0",
+                        },
+                    }
+                ]
+            )
+        }
+    )
+
+
+@pytest.fixture
+def hugging_face(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("HUGGING_FACE_TOKEN", "test_token")
+    with patch.object(scraper, "HfApi") as mock_hf_api, patch.object(
+        scraper.datasets, "get_dataset_config_names", return_value=["2023_all", "2023_level1"]
+    ), patch.object(scraper.datasets, "load_dataset", return_value=_gaia_dataset_dict()) as mock_load_dataset:
+        mock_hf_api.return_value.dataset_info.return_value = MagicMock(sha="revision-1")
+        yield mock_hf_api, mock_load_dataset
+
+
+def test_download_datasets_skips_unchanged_revision(hugging_face, tmp_path):
+    mock_hf_api, mock_load_dataset = hugging_face
+
+    assert download_datasets(output_format="parquet")
+    assert mock_load_dataset.call_count == 2
+    assert (tmp_path / "resources/datasets/validation/2023_all.parquet").exists()
+
+    mock_load_dataset.reset_mock()
+    download_datasets(output_format="parquet")
+    mock_load_dataset.assert_not_called()
+
+    # A new format or revision is exported again
+    download_datasets(output_format="csv")
+    assert mock_load_dataset.call_count == 2
+    mock_load_dataset.reset_mock()
+    mock_hf_api.return_value.dataset_info.return_value = MagicMock(sha="revision-2")
+    download_datasets(output_format="csv")
+    assert mock_load_dataset.call_count == 2
+    assert all(call.kwargs["revision"] == "revision-2" for call in mock_load_dataset.call_args_list)
+
+
+def test_load_datasets_from_parquet_export(hugging_face, tmp_path):
+    (tmp_path / "resources/cleaned_datasets").mkdir(parents=True)
+    download_datasets(output_format="csv")
+    download_datasets(output_format="parquet")
+
+    cleaned_datasets = load_datasets_from_filesystem()
+
+    assert list(cleaned_datasets) == ["resources/datasets/validation/2023_all.parquet"]
+    dataset_df = cleaned_datasets["resources/datasets/validation/2023_all.parquet"]
+    assert dataset_df.loc[0, "answer"] == "42"
+    assert dataset_df.loc[0, "metadata_steps"] == "1. Multiply the numbers, it's easy"
+    assert dataset_df.loc[0, "metadata_num_tools"] == 0
+    # The question has no attachment
+    assert pd.isna(dataset_df.loc[0, "file_name"])
+    assert pd.isna(dataset_df.loc[0, "file_path"])
+
+
+def test_export_replaces_other_format(hugging_face, tmp_path):
+    mock_hf_api, _ = hugging_face
+    download_datasets(output_format="parquet")
+    mock_hf_api.return_value.dataset_info.return_value = MagicMock(sha="revision-2")
+    download_datasets(output_format="csv")
+
+    assert list_dataset_files() == ["resources/datasets/validation/2023_all.csv"]
+    assert not (tmp_path / "resources/datasets/validation/2023_all.parquet").exists()
@@ -0,0 +1,76 @@
+import hashlib
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from dataset_setup import upload_attachments
+from dataset_setup.upload_attachments import compute_etag, is_unchanged, main
+
+
+@pytest.fixture
+def attachments_directory(tmp_path):
+    (tmp_path / "unchanged.txt").write_bytes(b"unchanged content")
+    (tmp_path / "changed.txt").write_bytes(b"new content")
+    (tmp_path / "new.txt").write_bytes(b"brand new")
+    with patch.object(upload_attachments, "ATTACHMENTS_DIRECTORY", str(tmp_path)):
+        yield tmp_path
+
+
+def test_compute_etag(tmp_path):
+    file_path = tmp_path / "file.bin"
+    file_path.write_bytes(b"a" * 10 + b"b" * 5)
+    assert compute_etag(str(file_path)) == hashlib.md5(b"a" * 10 + b"b" * 5).hexdigest()
+
+    part_digests = hashlib.md5(b"a" * 10).digest() + hashlib.md5(b"b" * 5).digest()
+    assert compute_etag(str(file_path), chunksize=10, multipart=True) == f"{hashlib.md5(part_digests).hexdigest()}-2"
+
+
+def test_is_unchanged_with_single_part_etag(tmp_path):
+    # Larger than the multipart threshold, but uploaded in a single part
+    file_path = tmp_path / "file.bin"
+    content = os.urandom(9 * 1024 * 1024)
+    file_path.write_bytes(content)
+    assert is_unchanged(str(file_path), {"size": len(content), "etag": hashlib.md5(content).hexdigest()})
+
+
+def test_is_unchanged_infers_multipart_chunksize(tmp_path):
+    file_path = tmp_path / "file.bin"
+    content = os.urandom(3 * 1024 * 1024 + 10)
+    file_path.write_bytes(content)
+    # Uploaded in 2 MB parts rather than the default chunk size
+    part_digests = b"".join(
+        hashlib.md5(content[i:i + 2 * 1024 * 1024]).digest() for i in range(0, len(content), 2 * 1024 * 1024)
+    )
+    etag = f"{hashlib.md5(part_digests).hexdigest()}-2"
+    assert is_unchanged(str(file_path), {"size": len(content), "etag": etag})
+    assert not is_unchanged(str(file_path), {"size": len(content) + 1, "etag": etag})
+
+
+@patch("dataset_setup.upload_attachments.get_attachment_cache")
+@patch("dataset_setup.upload_attachments.load_s3_bucket", return_value="bucket")
+@patch("dataset_setup.upload_attachments.get_s3_client")
+def test_main_uploads_only_changed_files(mock_get_s3_client, mock_load_s3_bucket, mock_get_attachment_cache, attachments_directory):
+    mock_s3_client = MagicMock()
+    mock_get_s3_client.return_value = mock_s3_client
+    mock_s3_client.get_paginator.return_value.paginate.return_value = [
+        {
+            "Contents": [
+                {"Key": "unchanged.txt", "Size": 17, "ETag": f'"{hashlib.md5(b"unchanged content").hexdigest()}"'},
+                {"Key": "changed.txt", "Size": 11, "ETag": f'"{hashlib.md5(b"old content").hexdigest()}"'},
+            ]
+        }
+    ]
+
+    summary = main(max_workers=2)
+
+    uploaded_keys = sorted(call.args[2] for call in mock_s3_client.upload_file.call_args_list)
+    assert uploaded_keys == ["changed.txt", "new.txt"]
+    assert mock_s3_client.get_paginator.call_count == 1
+    assert summary["uploaded"] == 2
+    assert summary["skipped"] == 1
+    assert summary["failed"] == 0
+    assert summary["uploaded_bytes"] == 20
+    assert summary["skipped_bytes"] == 17
+    cached_names = sorted(call.args[0] for call in mock_get_attachment_cache.return_value.add.call_args_list)
+    assert cached_names == ["bucket/changed.txt", "bucket/new.txt"]
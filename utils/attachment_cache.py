@@ -0,0 +1,349 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from glob import glob, escape
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # File locks are only available on POSIX, downloads are then only coordinated in-process
+    fcntl = None
+
+from utils.cache_utils import hash_file, hash_text
+
+MANIFEST_FILE_NAME = "manifest.sqlite3"
+LOCKS_DIRECTORY_NAME = ".locks"
+OBJECTS_DIRECTORY_NAME = "objects"
+
+logger = logging.getLogger(__name__)
+
+
+class AttachmentCache:
+    """
+    Content-addressed local attachment cache. Every distinct content is stored once under `objects/` by its sha256,
+    and the manifest indexes each attachment name (name, size, ETag, sha256 and last access). Names are hardlinks to
+    their object, so identical attachments under different names share the same storage.
+    Files are only served if they are in the manifest and their size and content hash still match it, so truncated or
+    corrupted files are dropped and downloaded again. The least recently used names are evicted once the objects take
+    more than `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.corruptions = 0
+        self._lock = threading.Lock()
+        self._name_locks: dict[str, threading.Lock] = {}
+        self._pins: dict[str, int] = {}
+
+        os.makedirs(os.path.join(directory, LOCKS_DIRECTORY_NAME), exist_ok=True)
+        os.makedirs(os.path.join(directory, OBJECTS_DIRECTORY_NAME), exist_ok=True)
+        self._connection = sqlite3.connect(
+            os.path.join(directory, MANIFEST_FILE_NAME),
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS attachments (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                sha256 TEXT NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS attachments_sha256 ON attachments (sha256)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS attachments_etag ON attachments (etag)")
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.directory, OBJECTS_DIRECTORY_NAME, sha256[:2], sha256)
+
+    @contextmanager
+    def lock(self, name: str, blocking: bool = True):
+        """
+        Hold the lock of a cached file, shared between the threads of this process and, through a file lock, with
+        other processes using the same cache directory. Only the holder downloads the file, the others wait for it.
+        :param blocking: Whether to wait for the lock, otherwise yield False right away if it is held elsewhere
+        :return: Whether the lock is held
+        """
+        with self._lock:
+            name_lock = self._name_locks.setdefault(name, threading.Lock())
+        if not name_lock.acquire(blocking=blocking):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            lock_path = os.path.join(self.directory, LOCKS_DIRECTORY_NAME, f"{hash_text(name)}.lock")
+            with open(lock_path, "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            name_lock.release()
+
+    def pin(self, name: str):
+        """
+        Keep the name from being evicted by this process while a reader uses it, until it is unpinned. Pins are
+        counted, so each `pin` needs its own `unpin`. Readers in other processes aren't protected.
+        """
+        with self._lock:
+            self._pins[name] = self._pins.get(name, 0) + 1
+
+    def unpin(self, name: str):
+        with self._lock:
+            if self._pins.get(name, 0) > 1:
+                self._pins[name] -= 1
+            else:
+                self._pins.pop(name, None)
+
+    def lookup(self, name: str) -> Optional[str]:
+        """
+        Return the local path of the cached file if it is complete and intact, otherwise return None.
+        """
+        if not self.contains(name):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self._connection.execute(
+                "UPDATE attachments SET last_access = ? WHERE name = ?", (time.time(), name)
+            )
+            self.hits += 1
+        return self.path(name)
+
+    def contains(self, name: str) -> bool:
+        """
+        Whether the file is in the manifest and still matches its size and content hash. Corrupted files are dropped.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, sha256 FROM attachments WHERE name = ?", (name,)
+            ).fetchone()
+        if row is None:
+            return False
+        if not self._verify(name, *row):
+            logger.warning(f"Cached attachment {name} is corrupted, dropping it from the cache")
+            self._remove(name)
+            with self._lock:
+                self.corruptions += 1
+            return False
+        return True
+
+    def etag(self, name: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag FROM attachments WHERE name = ?", (name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def find_object(self, etag: str) -> Optional[str]:
+        """
+        Return the sha256 of a stored object with the given ETag, to reuse it instead of downloading the same content.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT sha256 FROM attachments WHERE etag = ?", (etag,)
+            ).fetchall()
+        for (sha256,) in rows:
+            if os.path.exists(self.object_path(sha256)):
+                return sha256
+        return None
+
+    def record(self, name: str, etag: Optional[str] = None):
+        """
+        Add a completely written file to the manifest and evict the least recently used files beyond the budget. The
+        file becomes a hardlink to the object of its content, which is stored if it isn't already.
+        """
+        local_path = self.path(name)
+        size = os.path.getsize(local_path)
+        sha256 = hash_file(local_path)
+        object_path = self.object_path(sha256)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            _link(local_path, object_path)
+        elif not os.path.samefile(local_path, object_path):
+            _link(object_path, local_path)
+        self._upsert(name, size, etag, sha256)
+        self.evict(keep=name)
+
+    def link(self, name: str, sha256: str, etag: Optional[str] = None):
+        """
+        Add a name for an object already stored in the cache.
+        """
+        object_path = self.object_path(sha256)
+        local_path = self.path(name)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        _link(object_path, local_path)
+        self._upsert(name, os.path.getsize(object_path), etag, sha256)
+
+    def add(self, name: str, source_path: str, etag: Optional[str] = None):
+        """
+        Add a file from outside the cache, e.g. an attachment that was just uploaded to S3, under the given name.
+        """
+        local_path = self.path(name)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with self.lock(name):
+            _link(source_path, local_path)
+            self.record(name, etag)
+
+    def touch(self, name: str):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE attachments SET last_access = ? WHERE name = ?", (time.time(), name)
+            )
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        Evict the least recently used names until the objects and their derived files fit in `max_bytes`. Names locked
+        elsewhere, e.g. being downloaded, and names pinned by the readers of this process are skipped.
+        """
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT name, size, sha256 FROM attachments ORDER BY last_access"
+            ).fetchall()
+        # Objects only free their storage once every name linked to them is evicted
+        references = {}
+        object_sizes = {}
+        for _, entry_size, sha256 in rows:
+            references[sha256] = references.get(sha256, 0) + 1
+            object_sizes[sha256] = entry_size
+        derived_sizes = self._derived_sizes()
+        size = sum(object_sizes.values()) + sum(derived_sizes.values())
+        for name, entry_size, sha256 in rows:
+            if size <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            with self.lock(name, blocking=False) as locked:
+                # Names are pinned under their lock, so a pin can't be taken while the name is being removed
+                with self._lock:
+                    pinned = name in self._pins
+                if not locked or pinned:
+                    continue
+                self._remove(name)
+            size -= derived_sizes.get(self._stem(name), 0)
+            references[sha256] -= 1
+            if references[sha256] == 0:
+                size -= entry_size
+            with self._lock:
+                self.evictions += 1
+            logger.info(f"Evicted attachment {name} from the local cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._connection.execute(
+                """
+                SELECT
+                    (SELECT COUNT(*) FROM attachments),
+                    (SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, size FROM attachments))
+                """
+            ).fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "corruptions": self.corruptions,
+                "entries": entries,
+                "bytes": size,
+            }
+
+    def _verify(self, name: str, size: int, sha256: str) -> bool:
+        # The content hash is memoized per size and modification time, so each file is hashed once per process
+        local_path = self.path(name)
+        if not os.path.exists(local_path) or os.path.getsize(local_path) != size:
+            return False
+        return hash_file(local_path) == sha256
+
+    def _upsert(self, name: str, size: int, etag: Optional[str], sha256: str):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT sha256 FROM attachments WHERE name = ?", (name,)
+            ).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO attachments (name, size, etag, sha256, last_access) VALUES (?, ?, ?, ?, ?)",
+                (name, size, etag, sha256, time.time()),
+            )
+        if row is None or row[0] != sha256:
+            # Files derived from another content are stale, even if the new content's object is older than them
+            self._remove_derived(name)
+        # The previous content of a name that changed is no longer needed once nothing else links to it
+        if row is not None and row[0] != sha256:
+            self._remove_unreferenced_object(row[0])
+
+    def _stem(self, name: str) -> str:
+        return os.path.splitext(self.path(name))[0]
+
+    def _derived_sizes(self) -> dict[str, int]:
+        """
+        Total size of the derived files, such as preprocessed images, by the path stem of their source.
+        """
+        derived_sizes = {}
+        for file_path in glob(os.path.join(escape(self.directory), "**", "*.preprocessed.*"), recursive=True):
+            stem = file_path.rsplit(".preprocessed.", 1)[0]
+            derived_sizes[stem] = derived_sizes.get(stem, 0) + os.path.getsize(file_path)
+        return derived_sizes
+
+    def _remove(self, name: str):
+        local_path = self.path(name)
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        # Derived files such as preprocessed images are removed along with their source
+        self._remove_derived(name)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT sha256 FROM attachments WHERE name = ?", (name,)
+            ).fetchone()
+            self._connection.execute("DELETE FROM attachments WHERE name = ?", (name,))
+        if row is not None:
+            self._remove_unreferenced_object(row[0])
+
+    def _remove_derived(self, name: str):
+        for file_path in glob(f"{escape(self._stem(name))}.preprocessed.*"):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def _remove_unreferenced_object(self, sha256: str):
+        # The object is removed with the last name linked to it
+        with self._lock:
+            (references,) = self._connection.execute(
+                "SELECT COUNT(*) FROM attachments WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        if references == 0 and os.path.exists(self.object_path(sha256)):
+            os.remove(self.object_path(sha256))
+
+
+def _link(source_path: str, target_path: str):
+    """
+    Atomically replace `target_path` with a hardlink to `source_path`, or with a copy where hardlinks aren't supported.
+    """
+    temp_path = f"{target_path}.{threading.get_ident()}.link"
+    try:
+        os.link(source_path, temp_path)
+    except OSError:
+        shutil.copyfile(source_path, temp_path)
+    os.replace(temp_path, target_path)
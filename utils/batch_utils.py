@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from openai import OpenAI
+
+from models.benchmark_results import create_benchmark_results
+from models.test_cases import fetch_all_tests
+from utils.benchmark_utils import is_answer_correct, DEFAULT_BENCHMARK_MODELS
+from utils.openai_utils import get_openai_client, build_text_messages
+
+BATCH_DIRECTORY = os.path.join("resources", "batches")
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_PENDING_STATUSES = ["validating", "in_progress", "finalizing", "cancelling"]
+
+logger = logging.getLogger(__name__)
+
+
+def build_batch_requests(test_cases, model: str) -> list[dict]:
+    """
+    Build one Batch API chat completion request per test case, identified by the test case `task_id`.
+    """
+    return [
+        {
+            "custom_id": test_case.task_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {"model": model, "messages": build_text_messages(test_case.question)},
+        }
+        for test_case in test_cases
+    ]
+
+
+def write_batch_file(batch_requests: list[dict], file_path: str) -> str:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as f:
+        for batch_request in batch_requests:
+            f.write(json.dumps(batch_request) + "\n")
+    return file_path
+
+
+def submit_batch(openai_client: OpenAI, file_path: str, completion_window: str = "24h"):
+    with open(file_path, "rb") as f:
+        batch_file = openai_client.files.create(file=f, purpose="batch")
+    batch = openai_client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=completion_window,
+    )
+    logger.info(f"Submitted batch {batch.id} from {file_path}")
+    return batch
+
+
+def wait_on_batch(openai_client: OpenAI, batch, initial_interval: float = 5.0, max_interval: float = 60.0):
+    """
+    Poll the batch with backoff until it is no longer pending.
+    :return: The completed batch
+    """
+    interval = initial_interval
+    while batch.status in BATCH_PENDING_STATUSES:
+        time.sleep(interval)
+        interval = min(interval * 1.5, max_interval)
+        batch = openai_client.batches.retrieve(batch.id)
+        logger.info(f"Batch {batch.id} is {batch.status} | {batch.request_counts}")
+
+    if batch.status != "completed":
+        raise ValueError(f"OpenAI batch {batch.id} failed with status: {batch.status}")
+    return batch
+
+
+def parse_batch_output(output: str) -> dict[str, Optional[str]]:
+    """
+    Map each `task_id` of the batch output to the answer, or None if its request failed.
+    """
+    answers = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            error = result.get("error") or (response.get("body") or {}).get("error")
+            logger.error(f"Batch request for task {result['custom_id']} failed | Error: {error}")
+            answers[result["custom_id"]] = None
+            continue
+        answers[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return answers
+
+
+def run_batch_benchmark(
+    models: Optional[list[str]] = None,
+    limit: Optional[int] = None,
+    completion_window: str = "24h",
+    poll_interval: float = 5.0,
+) -> dict[str, Counter]:
+    """
+    Evaluate the test cases without attachments through the OpenAI Batch API. One batch is submitted per model, and the
+    answers are scored and stored in `benchmark_results` once the batches complete.
+    :param models: OpenAI models to evaluate, defaults to `DEFAULT_BENCHMARK_MODELS`
+    :param limit: Optionally evaluate only the first `limit` test cases without attachments
+    :param completion_window: Batch API completion window
+    :param poll_interval: Seconds to wait before the first status poll of a batch
+    :return: Status counts per model
+    """
+    models = models or DEFAULT_BENCHMARK_MODELS
+    test_cases = [test_case for test_case in fetch_all_tests() if not test_case.file_path]
+    if limit is not None:
+        test_cases = test_cases[:limit]
+    test_cases_by_id = {test_case.task_id: test_case for test_case in test_cases}
+    logger.info(f"Running batch benchmark for {len(test_cases)} test cases against {len(models)} models")
+
+    openai_client = get_openai_client()
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    batches = {}
+    for model in models:
+        batch_file_path = write_batch_file(
+            build_batch_requests(test_cases, model),
+            os.path.join(BATCH_DIRECTORY, f"{model}-{timestamp}.jsonl"),
+        )
+        batches[model] = submit_batch(openai_client, batch_file_path, completion_window)
+
+    summary = {}
+    for model, batch in batches.items():
+        # A failed batch only loses its own model's results, the other batches are already submitted and paid for
+        try:
+            summary[model] = ingest_batch(openai_client, model, batch, test_cases_by_id, poll_interval)
+        except Exception as e:
+            logger.error(f"Failed to ingest batch {batch.id} for {model} | Error: {e}")
+            summary[model] = Counter({"Error": len(test_cases_by_id)})
+
+    return summary
+
+
+def read_batch_answers(openai_client: OpenAI, batch) -> dict[str, Optional[str]]:
+    """
+    Answers of the completed batch by `task_id`, with None for the requests listed in its error file. The output file
+    is missing when every request failed.
+    """
+    answers = {}
+    if batch.output_file_id is not None:
+        answers.update(parse_batch_output(openai_client.files.content(batch.output_file_id).text))
+    if batch.error_file_id is not None:
+        answers.update(parse_batch_output(openai_client.files.content(batch.error_file_id).text))
+    return answers
+
+
+def ingest_batch(openai_client: OpenAI, model: str, batch, test_cases_by_id: dict, poll_interval: float) -> Counter:
+    """
+    Wait for the batch of the model to complete, then score its answers and store them in `benchmark_results`.
+    :return: Status counts of the model
+    """
+    summary = Counter()
+    batch = wait_on_batch(openai_client, batch, initial_interval=poll_interval)
+    answers = read_batch_answers(openai_client, batch)
+
+    benchmark_results = []
+    for task_id, llm_answer in answers.items():
+        test_case = test_cases_by_id.get(task_id)
+        if test_case is None or llm_answer is None:
+            summary["Error"] += 1
+            continue
+        status = "Accepted" if is_answer_correct(test_case.answer, llm_answer) else "Failed"
+        summary[status] += 1
+        benchmark_results.append(
+            {
+                "llm_answer": llm_answer,
+                "is_cot": False,
+                "model_name": model,
+                "prompted_question": test_case.question,
+                "task_id": task_id,
+                "status": status,
+            }
+        )
+    if missing_task_ids := test_cases_by_id.keys() - answers.keys():
+        logger.error(f"Batch {batch.id} has no output for {len(missing_task_ids)} test cases")
+        summary["Error"] += len(missing_task_ids)
+    create_benchmark_results(benchmark_results)
+    logger.info(f"Batch benchmark results for {model}: {dict(summary)}")
+    return summary
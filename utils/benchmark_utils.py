@@ -0,0 +1,169 @@
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
+from models.benchmark_results import create_benchmark_result
+from models.db import get_pool_stats
+from models.test_cases import fetch_all_tests, fetch_attachment_paths
+from utils.file_system_utils import load_file, prefetch_files
+from utils.openai_utils import (
+    invoke_openai_api,
+    get_response_cache,
+    transcribe_audio,
+    get_transcript_store,
+    AUDIO_FILE_FORMATS,
+)
+from utils.rate_limit_utils import rate_limit_stats
+
+DEFAULT_BENCHMARK_MODELS = ["gpt-4o-2024-05-13", "gpt-4o-mini-2024-07-18"]
+DEFAULT_BENCHMARK_CONCURRENCY = 16
+DEFAULT_TRANSCRIPTION_CONCURRENCY = 8
+
+logger = logging.getLogger(__name__)
+
+
+def is_answer_correct(expected_answer: str, model_answer: str) -> bool:
+    """
+    Score a model answer the same way the Streamlit page does: the expected answer must appear in the model answer.
+    """
+    return expected_answer.strip().lower() in model_answer.strip().lower()
+
+
+def evaluate_test_case(test_case, model: str, use_cache: bool = True) -> str:
+    """
+    Invoke the model for a single test case, score the answer and store it in `benchmark_results`.
+    :param test_case: Row returned by `fetch_all_tests`
+    :param model: The OpenAI model to evaluate
+    :param use_cache: Whether cached OpenAI responses may be reused
+    :return: Status stored for the test case
+    """
+    llm_answer = invoke_openai_api(
+        question=test_case.question,
+        file_path=test_case.file_path,
+        model=model,
+        use_cache=use_cache,
+    )
+    status = "Accepted" if is_answer_correct(test_case.answer, llm_answer) else "Failed"
+    create_benchmark_result(
+        llm_answer=llm_answer,
+        is_cot=False,
+        model_name=model,
+        prompted_question=test_case.question,
+        task_id=test_case.task_id,
+        status=status,
+    )
+    return status
+
+
+def run_benchmark(
+    models: Optional[list[str]] = None,
+    concurrency: int = DEFAULT_BENCHMARK_CONCURRENCY,
+    limit: Optional[int] = None,
+    use_cache: bool = True,
+    prefetch: bool = True,
+) -> dict[str, Counter]:
+    """
+    Evaluate every test case against each model, with at most `concurrency` requests in flight per model.
+    Failed invocations are logged and counted as `Error`, they are not stored in `benchmark_results`.
+    :param models: OpenAI models to evaluate, defaults to `DEFAULT_BENCHMARK_MODELS`
+    :param concurrency: Number of concurrent requests per model
+    :param limit: Optionally evaluate only the first `limit` test cases
+    :param use_cache: Whether cached OpenAI responses may be reused, disable to force fresh answers
+    :param prefetch: Whether to download all attachments into the local cache before invoking the models
+    :return: Status counts per model
+    """
+    models = models or DEFAULT_BENCHMARK_MODELS
+    test_cases = fetch_all_tests()
+    if limit is not None:
+        test_cases = test_cases[:limit]
+    logger.info(
+        f"Running benchmark for {len(test_cases)} test cases against {len(models)} models with concurrency {concurrency}"
+    )
+    if prefetch:
+        prefetch_files(
+            [test_case.file_path for test_case in test_cases if test_case.file_path],
+            max_workers=concurrency,
+        )
+
+    start_time = time.perf_counter()
+    summary = {model: Counter() for model in models}
+    executors = {
+        model: ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix=f"benchmark-{model}"
+        )
+        for model in models
+    }
+    try:
+        futures = {
+            executors[model].submit(
+                evaluate_test_case, test_case, model, use_cache
+            ): (
+                model,
+                test_case.task_id,
+            )
+            for model in models
+            for test_case in test_cases
+        }
+        for future in as_completed(futures):
+            model, task_id = futures[future]
+            try:
+                summary[model][future.result()] += 1
+            except Exception as e:
+                logger.error(
+                    f"Benchmark failed for task {task_id} with model {model} | Error: {e}"
+                )
+                summary[model]["Error"] += 1
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start_time
+    for model, counts in summary.items():
+        logger.info(f"Benchmark results for {model}: {dict(counts)}")
+    logger.info(f"OpenAI response cache: {get_response_cache().stats()}")
+    logger.info(f"OpenAI rate limits: {rate_limit_stats()}")
+    logger.info(f"Database connection pool: {get_pool_stats()}")
+    logger.info(f"Completed benchmark in {elapsed:.1f} sec")
+    return summary
+
+
+def _transcribe_attachment(file_path: str) -> str:
+    with load_file(file_path) as attachment:
+        return transcribe_audio(attachment.path)
+
+
+def transcribe_audio_attachments(
+    concurrency: int = DEFAULT_TRANSCRIPTION_CONCURRENCY,
+) -> Counter:
+    """
+    Transcribe every audio attachment referenced in `test_cases` ahead of a benchmark run, so audio questions only
+    need a chat completion. Already transcribed audio is skipped by the transcript store.
+    :param concurrency: Number of concurrent transcriptions
+    :return: Counts of transcribed and failed attachments
+    """
+    audio_paths = [
+        file_path
+        for file_path in fetch_attachment_paths()
+        if os.path.splitext(file_path)[1].lower() in AUDIO_FILE_FORMATS
+    ]
+    logger.info(f"Transcribing {len(audio_paths)} audio attachments with concurrency {concurrency}")
+
+    summary = Counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(_transcribe_attachment, file_path): file_path
+            for file_path in audio_paths
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+                summary["Transcribed"] += 1
+            except Exception as e:
+                logger.error(f"Failed to transcribe {futures[future]} | Error: {e}")
+                summary["Error"] += 1
+
+    logger.info(f"Transcription results: {dict(summary)} | Transcript store: {get_transcript_store().stats()}")
+    return summary
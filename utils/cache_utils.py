@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from typing import Iterable, Optional
+
+CACHE_DIRECTORY = os.path.join("resources", "cache")
+
+logger = logging.getLogger(__name__)
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Compute the sha256 hash of a file's content. Hashes are memoized per path, size and modification time.
+    """
+    stat = os.stat(file_path)
+    return _hash_file(file_path, stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=1024)
+def _hash_file(file_path: str, size: int, mtime_ns: int) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write_atomically(file_path: str, chunks: Iterable[bytes]):
+    """
+    Write the chunks to a temporary file next to `file_path` and rename it in place once complete, so readers never
+    see a partially written file.
+    """
+    directory = os.path.dirname(file_path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class SQLiteCache:
+    """
+    Small persistent key-value cache backed by SQLite, shared between threads and processes.
+    Entries are evicted least-recently-used first once the cache holds more than `max_bytes` of values, and entries
+    older than `max_age_seconds` are never returned.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: Optional[int] = None,
+        max_age_seconds: Optional[float] = None,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS cache_entries_accessed_at ON cache_entries (accessed_at)"
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM cache_entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self._is_expired(row[1], now):
+                self._connection.execute(
+                    "DELETE FROM cache_entries WHERE key = ?", (key,)
+                )
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM cache_entries")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.max_age_seconds is not None and now - created_at > self.max_age_seconds
+
+    def _evict(self, now: float):
+        if self.max_age_seconds is not None:
+            cursor = self._connection.execute(
+                "DELETE FROM cache_entries WHERE created_at < ?",
+                (now - self.max_age_seconds,),
+            )
+            self.evictions += cursor.rowcount
+        if self.max_bytes is None:
+            return
+        (size,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache_entries"
+        ).fetchone()
+        if size <= self.max_bytes:
+            return
+        # Drop the least recently used entries until the cache fits the budget again
+        rows = self._connection.execute(
+            "SELECT key, size FROM cache_entries ORDER BY accessed_at"
+        ).fetchall()
+        evicted_keys = []
+        for key, entry_size in rows:
+            if size <= self.max_bytes:
+                break
+            evicted_keys.append((key,))
+            size -= entry_size
+        self._connection.executemany(
+            "DELETE FROM cache_entries WHERE key = ?", evicted_keys
+        )
+        self.evictions += len(evicted_keys)
+        logger.info(f"Evicted {len(evicted_keys)} entries from cache {self.path}")
@@ -0,0 +1,83 @@
+import logging
+import os
+from functools import lru_cache
+from typing import Optional
+
+import pandas as pd
+
+from utils.cache_utils import SQLiteCache, CACHE_DIRECTORY, hash_file
+
+TABULAR_FILE_FORMATS = [".csv", ".xlsx"]
+TEXT_FILE_FORMATS = [".txt", ".json", ".jsonld", ".py"]
+EXTRACTABLE_FILE_FORMATS = TABULAR_FILE_FORMATS + TEXT_FILE_FORMATS
+DEFAULT_INLINE_ATTACHMENT_MAX_TOKENS = 8000
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def get_extraction_cache() -> SQLiteCache:
+    """
+    Persistent cache of the text extracted from attachments, keyed by the attachment content hash.
+    """
+    return SQLiteCache(os.path.join(CACHE_DIRECTORY, "extracted_text.sqlite3"))
+
+
+def get_inline_token_budget() -> int:
+    """
+    Largest extracted attachment, in estimated tokens, inlined into a chat completion instead of using the Assistants
+    API. Can be tuned with `OPENAI_INLINE_ATTACHMENT_MAX_TOKENS`.
+    """
+    return int(os.environ.get("OPENAI_INLINE_ATTACHMENT_MAX_TOKENS", DEFAULT_INLINE_ATTACHMENT_MAX_TOKENS))
+
+
+def is_extractable(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in EXTRACTABLE_FILE_FORMATS
+
+
+def extract_text(file_path: str) -> Optional[str]:
+    """
+    Extract the content of a tabular or plain-text attachment as text. Tables are rendered as CSV, one block per sheet.
+    :param file_path: Local path to the attachment
+    :return: The extracted text, or None if the attachment can't be extracted locally
+    """
+    if not is_extractable(file_path) or not os.path.exists(file_path):
+        return None
+
+    extraction_cache = get_extraction_cache()
+    cache_key = hash_file(file_path)
+    extracted_text = extraction_cache.get(cache_key)
+    if extracted_text is not None:
+        return extracted_text
+
+    try:
+        extracted_text = _extract_text(file_path)
+    except Exception as e:
+        logger.error(f"Failed to extract text from {file_path} | Error: {e}")
+        return None
+    extraction_cache.set(cache_key, extracted_text)
+    return extracted_text
+
+
+def _extract_text(file_path: str) -> str:
+    ext = os.path.splitext(file_path)[1].lower()
+    match ext:
+        case ".csv":
+            try:
+                return pd.read_csv(file_path).to_csv(index=False)
+            except pd.errors.ParserError:
+                # Not a well-formed table, the raw text is still useful
+                return _read_text(file_path)
+        case ".xlsx":
+            # Read with openpyxl
+            sheets = pd.read_excel(file_path, sheet_name=None)
+            return "\n".join(
+                f"Sheet: {sheet_name}\n{sheet_df.to_csv(index=False)}" for sheet_name, sheet_df in sheets.items()
+            )
+        case _:
+            return _read_text(file_path)
+
+
+def _read_text(file_path: str) -> str:
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        return f.read()
@@ -1,9 +1,21 @@
 import base64
+import io
 import logging
+import mmap
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
+from typing import Callable, Optional, BinaryIO
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from PIL import Image
+
+from utils.attachment_cache import AttachmentCache
+from utils.cache_utils import write_atomically
 
 LOCAL_CACHE_DIRECTORY = os.path.join("resources", "benchmark_attachments")
 OPENAI_SUPPORTED_FILE_FORMATS = [
@@ -32,6 +44,10 @@ OPENAI_SUPPORTED_FILE_FORMATS = [
 FILE_FORMATS_WITH_PICTURES = [
     ".xlsx",
 ]
+# Images are sent to the vision models at most at this resolution, larger images are downscaled by OpenAI anyway
+IMAGE_MAX_DIMENSION = 2048
+IMAGE_MAX_SHORT_SIDE = 768
+PREPROCESSED_IMAGE_FORMATS = [".png", ".jpg", ".jpeg", ".webp"]
 
 logger = logging.getLogger(__name__)
 
@@ -59,30 +75,228 @@ def load_s3_bucket():
     raise ValueError("Missing AWS S3 Bucket")
 
 
+_s3_client_lock = threading.Lock()
+
+
 def get_s3_client():
-    return boto3.client("s3", **load_aws_tokens())
+    """
+    Process-wide S3 client. boto3 clients are thread-safe, so every download shares one connection pool, sized by
+    `S3_MAX_POOL_CONNECTIONS`.
+    """
+    with _s3_client_lock:
+        return _create_s3_client()
+
+
+@lru_cache(maxsize=1)
+def _create_s3_client():
+    return boto3.client(
+        "s3",
+        config=Config(
+            max_pool_connections=int(os.environ.get("S3_MAX_POOL_CONNECTIONS", 32)),
+            retries={"max_attempts": 5, "mode": "adaptive"},
+        ),
+        **load_aws_tokens(),
+    )
+
+
+def get_attachment_cache() -> AttachmentCache:
+    """
+    Manifest-indexed cache of `LOCAL_CACHE_DIRECTORY`, bounded by `ATTACHMENT_CACHE_MAX_BYTES`.
+    """
+    return _get_attachment_cache(LOCAL_CACHE_DIRECTORY)
+
+
+@lru_cache(maxsize=None)
+def _get_attachment_cache(directory: str) -> AttachmentCache:
+    return AttachmentCache(
+        directory,
+        max_bytes=int(os.environ.get("ATTACHMENT_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024)),
+    )
+
+
+class Attachment:
+    """
+    Lazy handle to an attachment in the local cache. Nothing is read until the content is asked for, either streamed
+    through `open`, memory-mapped through `mmap` or read whole through `read`. Handles from `load_file` keep the file
+    pinned in the cache until they are closed, so use them as context managers.
+    """
+
+    def __init__(self, path: str, release: Optional[Callable[[], None]] = None):
+        self.path = path
+        self._release = release
+
+    @property
+    def extension(self) -> str:
+        return os.path.splitext(self.path)[1]
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def open(self) -> BinaryIO:
+        return open(self.path, "rb")
+
+    def mmap(self) -> mmap.mmap:
+        """
+        Read-only memory map of the attachment, to be closed by the caller. Empty files can't be memory-mapped.
+        """
+        with self.open() as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self) -> bytes:
+        return read_file_contents(self.path)
+
+    def close(self):
+        """
+        Unpin the file, it may be evicted from the cache afterwards.
+        """
+        if self._release is not None:
+            self._release()
+            self._release = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f"Attachment({self.path!r})"
+
+
+def load_file(key: str, prefer_picture: bool = True) -> Attachment:
+    """
+    Load the attachment from the local cache, downloading it from S3 if needed. The file is pinned in the cache, so it
+    isn't evicted while in use, until the returned handle is closed.
+    :param key: S3 key of the attachment
+    :param prefer_picture: Use the .png picture of `FILE_FORMATS_WITH_PICTURES` instead of the source file if available
+    :return: Lazy handle to the local file to use for the attachment
+    """
+    attachment_cache = get_attachment_cache()
+    filename = _fetch_file(key, prefer_picture, pin=True)
+    return Attachment(attachment_cache.path(filename), release=partial(attachment_cache.unpin, filename))
+
+
+def get_attachment_name(key: str) -> str:
+    """
+    Name of the attachment in the local cache: its S3 key relative to the cache, so same-named files under different
+    buckets or prefixes don't collide.
+    """
+    name = os.path.normpath(key.lstrip("/"))
+    if name.startswith(".."):
+        raise ValueError(f"Invalid attachment key: {key}")
+    return name
+
 
+def fetch_file(key: str, prefer_picture: bool = True) -> str:
+    """
+    Make the attachment available in the local cache, downloading it from S3 if needed. The file isn't pinned, so it
+    may be evicted by a later download, use `load_file` to read it.
+    :param key: S3 key of the attachment
+    :param prefer_picture: Use the .png picture of `FILE_FORMATS_WITH_PICTURES` instead of the source file if available
+    :return: Local path of the file to use for the attachment
+    """
+    return get_attachment_cache().path(_fetch_file(key, prefer_picture))
 
-def load_file(key: str) -> (bytes, str):
-    local_path = os.path.join(LOCAL_CACHE_DIRECTORY, os.path.basename(key))
-    _, ext = os.path.splitext(local_path)
+
+def _fetch_file(key: str, prefer_picture: bool = True, pin: bool = False) -> str:
+    """
+    :param pin: Pin the file while its lock is still held, so it can't be evicted before the caller unpins it
+    :return: Name of the file to use for the attachment in the local cache
+    """
+    attachment_cache = get_attachment_cache()
+    filename = get_attachment_name(key)
+    _, ext = os.path.splitext(filename)
 
     # If the file is of the complex file format, then prefer to use the picture (.png) file of the file
-    if ext in FILE_FORMATS_WITH_PICTURES:
-        updated_local_path = local_path.replace(ext, ".png")
-        if not os.path.exists(updated_local_path):
-            success = download(key.replace(ext, ".png"))
-            if success:
+    if prefer_picture and ext in FILE_FORMATS_WITH_PICTURES:
+        updated_filename = get_attachment_name(key.replace(ext, ".png"))
+        with attachment_cache.lock(updated_filename):
+            available = attachment_cache.lookup(updated_filename) is not None
+            if not available and download(key.replace(ext, ".png")):
                 logger.info(
                     f"Using the .png file instead of the actual source file: {key}"
                 )
+                available = True
+            if available:
+                if pin:
+                    attachment_cache.pin(updated_filename)
+                return updated_filename
+
+    # Concurrent requests for the same file wait for a single download, then find it in the cache
+    with attachment_cache.lock(filename):
+        if attachment_cache.lookup(filename) is None:
+            download(key)
+        if pin:
+            attachment_cache.pin(filename)
+    return filename
+
+
+def _prefetch_file(key: str, revalidate: bool = False) -> int:
+    """
+    Download the attachment into the local cache, along with the .png picture of `FILE_FORMATS_WITH_PICTURES`. The
+    picture is sent to the Assistants, while the source file is used when its content is extracted locally.
+    :return: Downloaded bytes
+    """
+    _, ext = os.path.splitext(key)
+    downloaded_bytes = 0
+    if ext in FILE_FORMATS_WITH_PICTURES:
+        downloaded_bytes += _prefetch_key(key.replace(ext, ".png"), revalidate, required=False)
+    return downloaded_bytes + _prefetch_key(key, revalidate)
+
 
-        if os.path.exists(updated_local_path):
-            return read_file_contents(updated_local_path), updated_local_path
+def _prefetch_key(key: str, revalidate: bool = False, required: bool = True) -> int:
+    attachment_cache = get_attachment_cache()
+    filename = get_attachment_name(key)
+    if attachment_cache.lookup(filename) is not None:
+        if not revalidate:
+            return 0
+        etag = attachment_cache.etag(filename)
+        with attachment_cache.lock(filename):
+            revalidated = download(key)
+        if not revalidated:
+            raise FileNotFoundError(f"Failed to revalidate {key}")
+        return os.path.getsize(attachment_cache.path(filename)) if attachment_cache.etag(filename) != etag else 0
 
-    if not os.path.exists(local_path):
-        download(key)
-    return read_file_contents(local_path), local_path
+    with attachment_cache.lock(filename):
+        if attachment_cache.lookup(filename) is None and not download(key):
+            if required:
+                raise FileNotFoundError(f"Failed to download {key}")
+            return 0
+    return os.path.getsize(attachment_cache.path(filename))
+
+
+def prefetch_files(keys: list[str], max_workers: int = 16, revalidate: bool = False) -> dict:
+    """
+    Download the attachments into the local cache in parallel, including the .png pictures of
+    `FILE_FORMATS_WITH_PICTURES`. Attachments already in the cache are skipped, unless `revalidate` is set.
+    :param keys: S3 keys of the attachments
+    :param max_workers: Number of concurrent downloads
+    :param revalidate: Re-download cached attachments whose ETag changed on S3
+    :return: Summary of the downloaded, cached and failed attachments with the downloaded bytes and throughput
+    """
+    os.makedirs(LOCAL_CACHE_DIRECTORY, exist_ok=True)
+    keys = sorted(set(keys))
+    summary = {"downloaded": 0, "cached": 0, "failed": 0, "bytes": 0}
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_prefetch_file, key, revalidate): key for key in keys}
+        for future in as_completed(futures):
+            try:
+                downloaded_bytes = future.result()
+            except Exception as e:
+                logger.error(f"Failed to prefetch {futures[future]} | Error: {e}")
+                summary["failed"] += 1
+                continue
+            summary["downloaded" if downloaded_bytes else "cached"] += 1
+            summary["bytes"] += downloaded_bytes
+    summary["seconds"] = round(time.perf_counter() - start_time, 2)
+    summary["mb_per_second"] = round(summary["bytes"] / 1024 / 1024 / max(summary["seconds"], 0.01), 2)
+
+    logger.info(f"Prefetched {len(keys)} attachments into {LOCAL_CACHE_DIRECTORY}: {summary}")
+    logger.info(f"Local attachment cache: {get_attachment_cache().stats()}")
+    return summary
 
 
 def read_file_contents(file_path: str) -> bytes:
@@ -90,27 +304,93 @@ def read_file_contents(file_path: str) -> bytes:
         return f.read()
 
 
-def download(key: str):
-    s3_client = get_s3_client()
-    filename = os.path.basename(key)
+def download(key: str) -> bool:
+    """
+    Download the file from S3 into the local cache with a single GET and record it in the cache manifest. If the file
+    is already cached with a known ETag, the GET is conditional and the cached file is kept when it hasn't changed.
+    If the ETag matches content already stored under another name, the body isn't read and the file is linked to it.
+    The body is written to a temporary file renamed in place once complete. Callers should hold the file's cache lock.
+    :param key: S3 key of the file
+    :return: True if the file is available in the local cache
+    """
+    attachment_cache = get_attachment_cache()
+    filename = get_attachment_name(key)
+    local_path = attachment_cache.path(filename)
+    request = {"Bucket": load_s3_bucket(), "Key": os.path.basename(key)}
+    if attachment_cache.contains(filename) and (etag := attachment_cache.etag(filename)):
+        request["IfNoneMatch"] = etag
+
     try:
-        _ = s3_client.head_object(Bucket=load_s3_bucket(), Key=filename)
-        s3_client.download_file(
-            load_s3_bucket(),
-            filename,
-            os.path.join(LOCAL_CACHE_DIRECTORY, filename),
-        )
-        logger.info(f"Downloaded file {key} from S3")
-        return True
+        response = get_s3_client().get_object(**request)
     except ClientError as e:
-        if e.response["Error"]["Code"] == "404":  # File not found
+        error_code = e.response["Error"]["Code"]
+        if error_code in ["304", "NotModified"]:
+            logger.info(f"File {key} not modified on S3")
+            attachment_cache.touch(filename)
+            return True
+        if error_code in ["404", "NoSuchKey"]:  # File not found
             logger.error(f"File {key} not found on S3")
             return False
-        else:
-            logger.error("")
-            return False
+        logger.error(f"Failed to download file {key} from S3 | Error: {e}")
+        return False
+
+    if (sha256 := attachment_cache.find_object(response["ETag"])) is not None:
+        response["Body"].close()
+        attachment_cache.link(filename, sha256, response["ETag"])
+        logger.info(f"File {key} is already cached under another name, linked it to the same content")
+        return True
+
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    write_atomically(local_path, response["Body"].iter_chunks(chunk_size=1024 * 1024))
+    attachment_cache.record(filename, response["ETag"])
+    logger.info(f"Downloaded file {key} from S3")
+    return True
+
+
+def preprocess_image(image_path: str) -> (bytes, str):
+    """
+    Downscale the image to the resolution used by the vision models and re-encode it compactly. Images with
+    transparency are re-encoded as optimized PNG, other images as JPEG. The result is cached next to the original as
+    `<name>.preprocessed.<ext>`, and the original is kept if re-encoding doesn't make it smaller.
+    :param image_path: Local path to the image
+    :return: Tuple of (image bytes, image file extension)
+    """
+    stem, ext = os.path.splitext(image_path)
+    if ext.lower() not in PREPROCESSED_IMAGE_FORMATS:
+        return read_file_contents(image_path), ext
+
+    for cached_ext in {".jpg", ".png", ext}:
+        cached_path = f"{stem}.preprocessed{cached_ext}"
+        if os.path.exists(cached_path) and os.path.getmtime(cached_path) >= os.path.getmtime(image_path):
+            return read_file_contents(cached_path), cached_ext
+
+    image_bytes = read_file_contents(image_path)
+    image = Image.open(io.BytesIO(image_bytes))
+    width, height = image.size
+    scale = min(1.0, IMAGE_MAX_DIMENSION / max(width, height), IMAGE_MAX_SHORT_SIDE / min(width, height))
+    if scale < 1.0:
+        image = image.resize(
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            Image.LANCZOS,
+        )
+
+    output = io.BytesIO()
+    if image.mode in ["RGBA", "LA", "PA"] or "transparency" in image.info:
+        preprocessed_ext = ".png"
+        image.save(output, format="PNG", optimize=True)
+    else:
+        preprocessed_ext = ".jpg"
+        image.convert("RGB").save(output, format="JPEG", quality=85, optimize=True)
+    preprocessed_bytes = output.getvalue()
+    if len(preprocessed_bytes) >= len(image_bytes):
+        preprocessed_bytes, preprocessed_ext = image_bytes, ext
+
+    write_atomically(f"{stem}.preprocessed{preprocessed_ext}", [preprocessed_bytes])
+    logger.info(
+        f"Preprocessed image {image_path} from {len(image_bytes)} to {len(preprocessed_bytes)} bytes"
+    )
+    return preprocessed_bytes, preprocessed_ext
 
 
-def encode_image(image_path: str) -> str:
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+def encode_image(image_bytes: bytes) -> str:
+    return base64.b64encode(image_bytes).decode("utf-8")
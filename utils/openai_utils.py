@@ -1,26 +1,59 @@
 import logging
 import os
+import re
+import threading
 import time
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from typing import Optional
 
+import httpx
 import openai
-import requests
-from openai import OpenAI, OpenAIError
+from openai import OpenAI, OpenAIError, DefaultHttpxClient
 from openai.types.beta import Thread
 from pandas.io.formats.style_render import refactor_levels
 from urllib3 import request
 
-from utils.file_system_utils import load_file, OPENAI_SUPPORTED_FILE_FORMATS, encode_image, LOCAL_CACHE_DIRECTORY
+from utils.cache_utils import SQLiteCache, CACHE_DIRECTORY, hash_text, hash_file
+from utils.extraction_utils import is_extractable, extract_text, get_inline_token_budget
+from utils.file_system_utils import load_file, OPENAI_SUPPORTED_FILE_FORMATS, encode_image, LOCAL_CACHE_DIRECTORY, preprocess_image
+from utils.rate_limit_utils import call_with_rate_limit, estimate_tokens
+
+AUDIO_FILE_FORMATS = [".mp3", ".mp4", ".mpeg", ".mpga", ".m4a", ".wav", ".webm"]
+# Upper estimate of the prompt tokens of a preprocessed image and of the file search context of an Assistants run
+IMAGE_TOKENS = 1105
+FILE_SEARCH_TOKENS = 16000
 
 logger = logging.getLogger(__name__)
 
 
 @lru_cache(maxsize=1)
 def get_openai_client():
+    """
+    Shared OpenAI client for every call path. The underlying HTTP connection pool is kept alive between requests and
+    can be tuned with `OPENAI_POOL_SIZE`, `OPENAI_TIMEOUT_SECONDS` and `OPENAI_MAX_RETRIES`.
+    """
     if "OPENAI_KEY" not in os.environ:
         raise ValueError("OpenAI Key not found in environment variables")
-    return OpenAI(api_key=os.environ["OPENAI_KEY"])
+    pool_size = int(os.environ.get("OPENAI_POOL_SIZE", 32))
+    return OpenAI(
+        api_key=os.environ["OPENAI_KEY"],
+        timeout=float(os.environ.get("OPENAI_TIMEOUT_SECONDS", 120)),
+        max_retries=int(os.environ.get("OPENAI_MAX_RETRIES", 3)),
+        http_client=DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            )
+        ),
+    )
+
+
+def get_rate_limited_client() -> OpenAI:
+    """
+    The shared client without the SDK retries, for the calls made through `call_with_rate_limit`, which retries 429s
+    itself once every caller of the model is paused.
+    """
+    return get_openai_client().with_options(max_retries=0)
 
 
 def get_openai_key():
@@ -40,25 +73,66 @@ def get_vector_store_id() -> Optional[str]:
         return os.environ["OPENAI_VECTOR_STORE_ID"]
     raise ValueError("OpenAI Vector Store ID not found in environment variables")
 
+
+@lru_cache(maxsize=1)
+def get_response_cache() -> SQLiteCache:
+    """
+    Persistent cache of OpenAI responses, bounded by `OPENAI_RESPONSE_CACHE_MAX_BYTES` and `OPENAI_RESPONSE_CACHE_MAX_AGE_DAYS`.
+    """
+    return SQLiteCache(
+        os.path.join(CACHE_DIRECTORY, "openai_responses.sqlite3"),
+        max_bytes=int(os.environ.get("OPENAI_RESPONSE_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+        max_age_seconds=float(os.environ.get("OPENAI_RESPONSE_CACHE_MAX_AGE_DAYS", 30)) * 24 * 60 * 60,
+    )
+
+
+def is_response_cache_bypassed() -> bool:
+    return os.environ.get("OPENAI_RESPONSE_CACHE_BYPASS", "").lower() in ["1", "true", "yes"]
+
+
 def _initial_setup():
     os.makedirs(LOCAL_CACHE_DIRECTORY, exist_ok=True)
 
 
-def wait_on_run(openai_client: OpenAI, run, thread):
+def _cached_response(invocation_type: str, model: str, question: str, file_path: Optional[str], use_cache: bool, invoke) -> str:
     """
-    Wait for the Assistants run to finish and return the response.
-    :param openai_client:
-    :param run:
-    :param thread:
-    :return:
+    Return the cached response for the (model, question, attachment) triple, or invoke OpenAI and cache the response.
+    When `use_cache` is False (or the cache is bypassed from the environment) the cached response is not read, but the
+    fresh response still replaces it.
+    :param invocation_type: The OpenAI call path, part of the cache key
+    :param model: The OpenAI model
+    :param question: The prompted question
+    :param file_path: Optional local path to the attachment, its content hash is part of the cache key
+    :param use_cache: Whether a cached response may be returned
+    :param invoke: Callable invoking OpenAI and returning the response
+    :return: The response text
     """
-    while run.status == "queued" or run.status == "in_progress":
-        run = openai_client.beta.threads.runs.retrieve(
-            thread_id=thread.id,
-            run_id=run.id,
-        )
-        time.sleep(0.5)
+    response_cache = get_response_cache()
+    attachment_hash = hash_file(file_path) if file_path else "-"
+    cache_key = f"{invocation_type}:{model}:{hash_text(question)}:{attachment_hash}"
+
+    if use_cache and not is_response_cache_bypassed():
+        response = response_cache.get(cache_key)
+        if response is not None:
+            logger.info(f"Using cached {invocation_type} response for model: {model}")
+            return response
+
+    response = invoke()
+    response_cache.set(cache_key, response)
+    return response
 
+
+def get_run_mode() -> str:
+    """
+    How Assistants runs are awaited: `stream` consumes run events as they arrive, `poll` polls the run with backoff.
+    """
+    run_mode = os.environ.get("OPENAI_RUN_MODE", "stream")
+    if run_mode not in ["stream", "poll"]:
+        raise ValueError(f"Unsupported OpenAI run mode: {run_mode}")
+    return run_mode
+
+
+def _check_run_status(run):
     if run.status in [
         "requires_action",
         "cancelling",
@@ -71,84 +145,195 @@ def wait_on_run(openai_client: OpenAI, run, thread):
             "OpenAI Assistant computing chat completion failed with status: "
             + str(run.status)
         )
-
     return run
 
+
+def wait_on_run(openai_client: OpenAI, run, thread, initial_interval: float = 0.1, max_interval: float = 2.0):
+    """
+    Wait for the Assistants run to finish and return the response.
+    The polling interval starts at `initial_interval` and backs off up to `max_interval`, so short runs return quickly
+    while long runs don't flood the API with requests.
+    :param openai_client:
+    :param run:
+    :param thread:
+    :param initial_interval: Seconds to wait before the first poll
+    :param max_interval: Maximum seconds between two polls
+    :return:
+    """
+    interval = initial_interval
+    while run.status == "queued" or run.status == "in_progress":
+        time.sleep(interval)
+        interval = min(interval * 1.5, max_interval)
+        run = openai_client.beta.threads.runs.retrieve(
+            thread_id=thread.id,
+            run_id=run.id,
+        )
+
+    return _check_run_status(run)
+
+
+def run_assistant(openai_client: OpenAI, thread, assistant_id: str, model: str):
+    """
+    Execute an Assistants run on the thread and wait for it to finish.
+    In `stream` run mode the run events are consumed as they arrive, and if the event stream is interrupted the run is
+    polled instead. In `poll` run mode the run is polled with backoff. The run is started without the SDK retries, as
+    it is rate limited by `call_with_rate_limit`, polls are retried as usual.
+    :param openai_client:
+    :param thread:
+    :param assistant_id:
+    :param model:
+    :return: The finished run
+    """
+    rate_limited_client = openai_client.with_options(max_retries=0)
+    if get_run_mode() == "poll":
+        run = rate_limited_client.beta.threads.runs.create(
+            thread_id=thread.id, assistant_id=assistant_id, model=model
+        )
+        return wait_on_run(openai_client, run, thread)
+
+    with rate_limited_client.beta.threads.runs.stream(
+        thread_id=thread.id, assistant_id=assistant_id, model=model
+    ) as stream:
+        try:
+            stream.until_done()
+            return _check_run_status(stream.get_final_run())
+        except (openai.APIConnectionError, httpx.HTTPError) as e:
+            run = stream.current_run
+            if run is None:
+                raise
+            logger.warning(
+                f"Event stream for run {run.id} interrupted, falling back to polling | Error: {e}"
+            )
+    return wait_on_run(openai_client, run, thread)
+
+
+@lru_cache(maxsize=1)
+def get_transcript_store() -> SQLiteCache:
+    """
+    Persistent store of audio transcriptions, keyed by the transcription model and the audio content hash.
+    """
+    return SQLiteCache(os.path.join(CACHE_DIRECTORY, "transcripts.sqlite3"))
+
+
+def transcribe_audio(file_path: str, transcription_model: str = "whisper-1") -> str:
+    """
+    Transcribe the audio file, reusing the stored transcript if the same audio was already transcribed.
+    :param file_path: Local path to the audio file
+    :param transcription_model: The OpenAI transcription model
+    :return: The transcribed text
+    """
+    transcript_store = get_transcript_store()
+    transcript_key = f"{transcription_model}:{hash_file(file_path)}"
+
+    def _transcribe():
+        with open(file_path, "rb") as audio_file:
+            return get_rate_limited_client().audio.transcriptions.create(
+                model=transcription_model,
+                file=audio_file,
+                response_format="text"
+            )
+
+    transcription = transcript_store.get(transcript_key)
+    if transcription is None:
+        transcription = call_with_rate_limit(transcription_model, 0, _transcribe)
+        transcript_store.set(transcript_key, transcription)
+        logger.info(f"Transcribed audio file {file_path}")
+    return transcription
+
+
 def _invoke_audio_assistants(model: str, question: str, file_path: str, file_extension: str):
-    openai_client = get_openai_client()
+    openai_client = get_rate_limited_client()
+    transcription = transcribe_audio(file_path)
+
+    messages = [
+        {
+            "role": "system",
+            "content": "You are an AI language model. You will be given a question along with transcribed text from an audio file. Your task is to provide an accurate and concise answer to the question based solely on the information provided in the transcribed text."
+        },
+        {
+            "role": "user",
+            "content": f"""You will find below the question and the transcribed text from an audio file. Based on the transcribed text, answer the question as accurately as possible.
 
-    audio_file = open(file_path, "rb")
-    transcription = openai_client.audio.transcriptions.create(
-        model="whisper-1",
-        file=audio_file,
-        response_format="text"
+Question: {question}
+Transcribed Audio: {transcription}"""
+        }
+    ]
+    response = call_with_rate_limit(
+        model,
+        estimate_tokens(question + transcription),
+        partial(openai_client.chat.completions.create, model=model, temperature=0, messages=messages),
     )
+    return response.choices[0].message.content
 
-    response = openai_client.chat.completions.create(
-        model=model,
-        temperature=0,
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an AI language model. You will be given a question along with transcribed text from an audio file. Your task is to provide an accurate and concise answer to the question based solely on the information provided in the transcribed text."
-            },
-            {
-                "role": "user",
-                "content": f"""You will find below the question and the transcribed text from an audio file. Based on the transcribed text, answer the question as accurately as possible.
+
+def _invoke_inline_attachment(model: str, question: str, file_name: str, extracted_text: str) -> str:
+    openai_client = get_rate_limited_client()
+    messages = [
+        {
+            "role": "system",
+            "content": "You are an AI language model. You will be given a question along with the content of an attached file. Your task is to provide an accurate and concise answer to the question based on the content of the file."
+        },
+        {
+            "role": "user",
+            "content": f"""You will find below the question and the content of the attached file. Based on the file content, answer the question as accurately as possible.
 
 Question: {question}
-Transcribed Audio: {transcription}"""
-            }
-        ]
+Attached file ({file_name}):
+{extracted_text}"""
+        }
+    ]
+    response = call_with_rate_limit(
+        model,
+        estimate_tokens(question + extracted_text),
+        partial(openai_client.chat.completions.create, model=model, temperature=0, messages=messages),
     )
     return response.choices[0].message.content
 
 
 def _invoke_image_assistants(model: str, question: str, file_path: str, file_extension: str) -> str:
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {get_openai_key()}",
-    }
-    encoded_image = encode_image(file_path)
-    file_extension = file_extension.replace(".", "")
-
-    payload = {
-        "model": model,
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": question
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/{file_extension};base64,{encoded_image}"
-                        }
+    openai_client = get_rate_limited_client()
+    # The image is read at most once here, and not at all if its preprocessed version is cached
+    image_bytes, file_extension = preprocess_image(file_path)
+    encoded_image = encode_image(image_bytes)
+    file_extension = file_extension.replace(".", "").lower().replace("jpg", "jpeg")
+
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": question
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/{file_extension};base64,{encoded_image}"
                     }
-                ]
-            }
-        ],
-        "max_tokens": 600,
-    }
-    response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-    if response.ok:
-        return response.json()["choices"][0]["message"]["content"]
-    else:
-        raise ValueError(f"API call to OpenAI Vision API failed with {response.status_code} code and {response.text}")
-
+                }
+            ]
+        }
+    ]
+    try:
+        response = call_with_rate_limit(
+            model,
+            estimate_tokens(question, IMAGE_TOKENS + 600),
+            partial(openai_client.chat.completions.create, model=model, messages=messages, max_tokens=600),
+        )
+    except OpenAIError as e:
+        raise ValueError(f"API call to OpenAI Vision API failed with {e}") from e
+    return response.choices[0].message.content
 
-def _invoke_other_assistants(model: str, question: str, updated_file_path: str, file_extension: str) -> str:
 
+@lru_cache(maxsize=None)
+def _ensure_assistant_vector_store(assistant_id: str, vector_store_id: str) -> bool:
+    """
+    Attach the vector store to the assistant if it isn't already. The check is done once per process.
+    """
     openai_client = get_openai_client()
-    assistant_id = get_assistant_id()
-    vector_store_id = get_vector_store_id()
-
     assistant = openai_client.beta.assistants.retrieve(assistant_id=assistant_id)
     if vector_store_id not in assistant.tool_resources.file_search.vector_store_ids:
-        assistant = openai_client.beta.assistants.update(
+        openai_client.beta.assistants.update(
             assistant_id=assistant_id,
             tool_resources={
                 "file_search": {
@@ -157,19 +342,71 @@ def _invoke_other_assistants(model: str, question: str, updated_file_path: str,
             },
         )
         logger.info(f"Assistant {assistant_id} updated with vector store id")
+    return True
+
+
+@lru_cache(maxsize=1)
+def get_file_registry() -> SQLiteCache:
+    """
+    Persistent registry mapping the sha256 of an attachment to the id of the file uploaded to OpenAI.
+    """
+    return SQLiteCache(os.path.join(CACHE_DIRECTORY, "openai_files.sqlite3"))
+
+
+_validated_file_ids = set()
+_validated_file_ids_lock = threading.Lock()
+
+
+def get_or_upload_file(openai_client: OpenAI, file_path: str) -> str:
+    """
+    Return the OpenAI file id for the attachment, uploading it only if the same content was never uploaded or the
+    uploaded file has since expired or been deleted. Registered file ids are validated once per process.
+    :param openai_client:
+    :param file_path: Local path to the attachment
+    :return: The OpenAI file id
+    """
+    file_registry = get_file_registry()
+    content_hash = hash_file(file_path)
+
+    file_id = file_registry.get(content_hash)
+    if file_id is not None:
+        with _validated_file_ids_lock:
+            if file_id in _validated_file_ids:
+                return file_id
+        try:
+            openai_client.files.retrieve(file_id)
+            with _validated_file_ids_lock:
+                _validated_file_ids.add(file_id)
+            return file_id
+        except openai.NotFoundError:
+            logger.info(f"OpenAI file {file_id} no longer exists, uploading {file_path} again")
+            file_registry.delete(content_hash)
+
+    with open(file_path, "rb") as f:
+        message_file = openai_client.files.create(file=f, purpose="assistants")
+    logger.info(f"Uploaded {file_path} to OpenAI as {message_file.id}")
+    file_registry.set(content_hash, message_file.id)
+    with _validated_file_ids_lock:
+        _validated_file_ids.add(message_file.id)
+    return message_file.id
 
-    # Download the file from S3, verify the file extension is usable with OpenAI, and upload to OpenAI
 
+def _invoke_other_assistants(model: str, question: str, updated_file_path: str, file_extension: str) -> str:
+    # Verify the file extension is usable with OpenAI before uploading it. This is an error rather than an answer, so
+    # it isn't cached or scored
     if file_extension not in OPENAI_SUPPORTED_FILE_FORMATS:
         logger.error(
             f"File format {file_extension} is not supported by OpenAI"
         )
-        return f"File format {file_extension} is not supported by OpenAI. API call to OpenAI not made."
+        raise ValueError(f"File format {file_extension} is not supported by OpenAI. API call to OpenAI not made.")
 
-    message_file = openai_client.files.create(
-        file=open(updated_file_path, "rb"),
-        purpose="assistants",
-    )
+    openai_client = get_openai_client()
+    assistant_id = get_assistant_id()
+    vector_store_id = get_vector_store_id()
+
+    _ensure_assistant_vector_store(assistant_id, vector_store_id)
+
+    file_id = get_or_upload_file(openai_client, updated_file_path)
 
     thread: Thread = openai_client.beta.threads.create(
         messages=[
@@ -177,7 +414,7 @@ def _invoke_other_assistants(model: str, question: str, updated_file_path: str,
                 "role": "user",
                 "content": question,
                 "attachments": [
-                    {"file_id": message_file.id, "tools": [{"type": "file_search"}]}
+                    {"file_id": file_id, "tools": [{"type": "file_search"}]}
                 ],
             }
         ]
@@ -186,10 +423,12 @@ def _invoke_other_assistants(model: str, question: str, updated_file_path: str,
     #     thread_id=thread.id,
     #     role="user",
     #     content=question,
-    #     attachments=[{"file_id": message_file.id, "tools": [{"type": "file_search"}]}],
+    #     attachments=[{"file_id": file_id, "tools": [{"type": "file_search"}]}],
     # )
-    run = openai_client.beta.threads.runs.create_and_poll(
-        thread_id=thread.id, assistant_id=assistant_id, model=model
+    run = call_with_rate_limit(
+        model,
+        estimate_tokens(question, FILE_SEARCH_TOKENS),
+        partial(run_assistant, openai_client, thread, assistant_id, model),
     )
 
     messages = list(
@@ -197,47 +436,135 @@ def _invoke_other_assistants(model: str, question: str, updated_file_path: str,
     )
 
     message_content = messages[0].content[0].text
-    annotations = message_content.annotations
-    citations = []
+    return _format_citations(openai_client, message_content.value, message_content.annotations)
+
+
+_file_names = {}
+_file_names_lock = threading.Lock()
+
 
+def _resolve_file_names(openai_client: OpenAI, file_ids: set[str]) -> dict[str, str]:
+    """
+    Resolve OpenAI file ids to their file names, retrieving the unknown ids concurrently. Names are cached for the life
+    of the process.
+    """
+    with _file_names_lock:
+        missing_file_ids = [file_id for file_id in file_ids if file_id not in _file_names]
+    if missing_file_ids:
+        with ThreadPoolExecutor(max_workers=min(8, len(missing_file_ids))) as executor:
+            cited_files = executor.map(openai_client.files.retrieve, missing_file_ids)
+            resolved = {file_id: cited_file.filename for file_id, cited_file in zip(missing_file_ids, cited_files)}
+        with _file_names_lock:
+            _file_names.update(resolved)
+    with _file_names_lock:
+        return {file_id: _file_names[file_id] for file_id in file_ids}
+
+
+def _format_citations(openai_client: OpenAI, message: str, annotations) -> str:
+    """
+    Replace the annotation markers in the message with `[idx]` references in a single pass and list the cited files
+    below the message.
+    """
+    file_names = _resolve_file_names(
+        openai_client,
+        {
+            annotation.file_citation.file_id
+            for annotation in annotations
+            if getattr(annotation, "file_citation", None)
+        },
+    )
+
+    references = {}
+    citations = []
     for idx, annotation in enumerate(annotations):
-        message_content.value = message_content.value.replace(
-            annotation.text, f"[{idx}]"
-        )
+        if annotation.text:
+            references.setdefault(annotation.text, f"[{idx}]")
         if file_citation := getattr(annotation, "file_citation", None):
-            cited_file = openai_client.files.retrieve(file_citation.file_id)
-            citations.append(f"[{idx}] {cited_file.filename}")
+            citations.append(f"[{idx}] {file_names[file_citation.file_id]}")
 
-    final_message = message_content.value + "\n\n " + "\n".join(citations)
-    return final_message
+    if references:
+        pattern = re.compile(
+            "|".join(re.escape(text) for text in sorted(references, key=len, reverse=True))
+        )
+        message = pattern.sub(lambda match: references[match.group(0)], message)
 
+    return message + "\n\n " + "\n".join(citations)
 
 
-def get_openai_response_with_attachments(question: str, model: str, file_path=None):
+
+def get_openai_response_with_attachments(question: str, model: str, file_path=None, use_cache: bool = True):
     """
     Create a prompt with attachment.
 
     :param question: The user's question
     :param model: The OpenAI model to use
     :param file_path: Optional path to a file to attach
+    :param use_cache: Whether a cached response may be returned
     :return: Tuple of (assistant_id, thread_id)
     """
     if not file_path:
         logger.error("File path cannot be empty")
         raise ValueError("File attachment path for a test case cannot be empty")
 
-    file_buffer, updated_file_path = load_file(file_path)
-    file_extension = os.path.splitext(updated_file_path)[1]
-    match file_extension:
-        case ".mp3" | ".mp4" | ".mpeg" | ".mpga" | ".m4a" | ".wav" | "webm":
-            return _invoke_audio_assistants(model, question, updated_file_path, file_extension)
-        case ".png" | ".jpeg" | ".jpg" | ".webp" | ".gif":
-            return _invoke_image_assistants(model, question, updated_file_path, file_extension)
-        case _:
-            return _invoke_other_assistants(model, question, updated_file_path, file_extension)
+    # Small tabular and plain-text attachments are extracted locally and inlined into a single chat completion,
+    # only the documents that don't fit the token budget go through the Assistants API
+    # The attachments stay pinned in the local cache while they are hashed, read or uploaded
+    if is_extractable(file_path):
+        with load_file(file_path, prefer_picture=False) as source_attachment:
+            extracted_text = extract_text(source_attachment.path)
+            if extracted_text is not None and estimate_tokens(extracted_text, 0) <= get_inline_token_budget():
+                file_name = os.path.basename(source_attachment.path)
+                return _cached_response(
+                    "inline",
+                    model,
+                    question,
+                    source_attachment.path,
+                    use_cache,
+                    lambda: _invoke_inline_attachment(model, question, file_name, extracted_text),
+                )
+
+    with load_file(file_path) as attachment:
+        updated_file_path = attachment.path
+        file_extension = attachment.extension
+        match file_extension:
+            case ".mp3" | ".mp4" | ".mpeg" | ".mpga" | ".m4a" | ".wav" | ".webm":
+                invocation_type, invoke_assistants = "audio", _invoke_audio_assistants
+            case ".png" | ".jpeg" | ".jpg" | ".webp" | ".gif":
+                invocation_type, invoke_assistants = "image", _invoke_image_assistants
+            case _:
+                invocation_type, invoke_assistants = "assistants", _invoke_other_assistants
+        return _cached_response(
+            invocation_type,
+            model,
+            question,
+            updated_file_path,
+            use_cache,
+            lambda: invoke_assistants(model, question, updated_file_path, file_extension),
+        )
+
+
+def build_text_messages(question: str) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": """You are an assistant designed to provide clear and accurate answers based on the information in the user's prompt. Use your knowledge to reason through the query and offer concise, relevant, and well-explained responses.""",
+        },
+        {"role": "user", "content": question},
+    ]
 
 
-def get_openai_response(question: str, model: str) -> str:
+def _invoke_chat_completion(question: str, model: str) -> str:
+    openai_client = get_rate_limited_client()
+    messages = build_text_messages(question)
+    completion = call_with_rate_limit(
+        model,
+        estimate_tokens(question),
+        partial(openai_client.chat.completions.create, model=model, messages=messages),
+    )
+    return completion.choices[0].message.content
+
+
+def get_openai_response(question: str, model: str, use_cache: bool = True) -> str:
     """
     This function sends a question to the specified OpenAI model and returns the response.
     The system message sets the context that the AI assistant is being benchmarked for performance and should answer quickly and accurately.
@@ -245,44 +572,49 @@ def get_openai_response(question: str, model: str) -> str:
     Args:
         question (str): The user's question to be answered by the AI assistant.
         model (str): The OpenAI model to use for the response.
+        use_cache (bool): Whether a cached response may be returned. Error responses are never cached.
 
     Returns:
         str: The response from the AI assistant as a string.
+
+    Raises:
+        openai.RateLimitError: If the request is still rate limited after retrying, so it isn't scored as an answer.
     """
-    openai_client = get_openai_client()
     try:
-        completion = openai_client.chat.completions.create(
-            model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": """You are an assistant designed to provide clear and accurate answers based on the information in the user's prompt. Use your knowledge to reason through the query and offer concise, relevant, and well-explained responses.""",
-                },
-                {"role": "user", "content": question},
-            ],
+        return _cached_response(
+            "text",
+            model,
+            question,
+            None,
+            use_cache,
+            lambda: _invoke_chat_completion(question, model),
         )
+    except openai.RateLimitError:
+        raise
     except OpenAIError as e:
-        err_msg = e.body["message"]
+        # Connection errors and timeouts have no response body
+        body = getattr(e, "body", None)
+        err_msg = body.get("message", str(e)) if isinstance(body, dict) else str(e)
         logger.error(
             f"Error while invoking OpenAI API with model: {model} | Error: {err_msg}"
         )
         return f"Error invoking OpenAI API: {err_msg}"
-    return completion.choices[0].message.content
 
 
 def invoke_openai_api(
     question: str,
     file_path: Optional[str] = None,
     model: str = "gpt-4o-2024-05-13",
+    use_cache: bool = True,
 ) -> str:
     # Create directories if not present
     _initial_setup()
     if file_path is not None:
         return get_openai_response_with_attachments(
-            question=question, file_path=file_path, model=model
+            question=question, file_path=file_path, model=model, use_cache=use_cache
         )
     else:
-        return get_openai_response(question=question, model=model)
+        return get_openai_response(question=question, model=model, use_cache=use_cache)
 
 
 # Example usage:
@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import openai
+
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 30000
+DEFAULT_RATE_LIMIT_ATTEMPTS = 5
+# Failures of a single request, retried with backoff without pausing the other callers of the model
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for one model, enforcing both a requests-per-minute and a tokens-per-minute budget.
+    Callers block in `acquire` until both buckets can cover the request, and `reconcile` the reservation with the
+    tokens the request actually used. A 429 from the API pauses every caller of the model through `pause`.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_depth = 0
+        self._available_requests = float(requests_per_minute)
+        self._available_tokens = float(tokens_per_minute)
+        self._paused_until = 0.0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 0) -> int:
+        """
+        Block until one request and `tokens` tokens are available and take them.
+        :return: The tokens reserved
+        """
+        # A single request can never need more than the whole budget
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            self.queue_depth += 1
+        try:
+            while True:
+                with self._lock:
+                    wait = self._reserve(tokens)
+                if wait <= 0:
+                    return tokens
+                time.sleep(wait)
+        finally:
+            with self._lock:
+                self.queue_depth -= 1
+
+    def reconcile(self, reserved_tokens: int, used_tokens: int):
+        """
+        Credit back the reserved tokens the request didn't use, or take the tokens it used beyond its reservation.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available_tokens = min(
+                self.tokens_per_minute, self._available_tokens + reserved_tokens - used_tokens
+            )
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "queue_depth": self.queue_depth,
+                "available_requests": int(self._available_requests),
+                "available_tokens": int(self._available_tokens),
+            }
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._available_requests = min(
+            self.requests_per_minute,
+            self._available_requests + elapsed * self.requests_per_minute / 60,
+        )
+        self._available_tokens = min(
+            self.tokens_per_minute,
+            self._available_tokens + elapsed * self.tokens_per_minute / 60,
+        )
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Take one request and `tokens` tokens from the buckets if available, otherwise return the seconds to wait.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(
+            self._paused_until - now,
+            (1 - self._available_requests) * 60 / self.requests_per_minute,
+            (tokens - self._available_tokens) * 60 / self.tokens_per_minute,
+        )
+        if wait > 0:
+            return wait
+        self._available_requests -= 1
+        self._available_tokens -= tokens
+        return 0
+
+
+_rate_limiters: dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def load_rate_limits(model: str) -> (int, int):
+    """
+    Requests and tokens per minute for the model. `OPENAI_RATE_LIMITS` can hold per-model overrides as JSON, e.g.
+    `{"gpt-4o-2024-05-13": {"rpm": 5000, "tpm": 800000}}`, other models use `OPENAI_RPM_LIMIT` and `OPENAI_TPM_LIMIT`.
+    """
+    model_limits = json.loads(os.environ.get("OPENAI_RATE_LIMITS") or "{}").get(model, {})
+    return (
+        int(model_limits.get("rpm", os.environ.get("OPENAI_RPM_LIMIT", DEFAULT_REQUESTS_PER_MINUTE))),
+        int(model_limits.get("tpm", os.environ.get("OPENAI_TPM_LIMIT", DEFAULT_TOKENS_PER_MINUTE))),
+    )
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    with _rate_limiters_lock:
+        if model not in _rate_limiters:
+            _rate_limiters[model] = RateLimiter(*load_rate_limits(model))
+        return _rate_limiters[model]
+
+
+def rate_limit_stats() -> dict[str, dict]:
+    with _rate_limiters_lock:
+        rate_limiters = dict(_rate_limiters)
+    return {model: rate_limiter.stats() for model, rate_limiter in rate_limiters.items()}
+
+
+def estimate_tokens(text: str, completion_tokens: int = 1000) -> int:
+    """
+    Rough token estimate of a request, about four characters per prompt token plus the expected completion.
+    """
+    return len(text) // 4 + completion_tokens
+
+
+def get_retry_after(error: openai.RateLimitError) -> Optional[float]:
+    headers = error.response.headers
+    if retry_after_ms := headers.get("retry-after-ms"):
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    if retry_after := headers.get("retry-after"):
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return None
+
+
+def get_used_tokens(response) -> Optional[int]:
+    """
+    Total tokens reported in the `usage` of a chat completion or Assistants run, None if it isn't reported.
+    """
+    total_tokens = getattr(getattr(response, "usage", None), "total_tokens", None)
+    return total_tokens if isinstance(total_tokens, int) else None
+
+
+def call_with_rate_limit(model: str, estimated_tokens: int, invoke, max_attempts: int = DEFAULT_RATE_LIMIT_ATTEMPTS):
+    """
+    Invoke an OpenAI API call within the model's rate limits. On a 429 every caller of the model is paused for the
+    `Retry-After` delay (or an exponential backoff) before the call is retried, so `invoke` shouldn't retry 429s
+    itself. Connection errors, timeouts and 5xx errors are retried with an exponential backoff of the call alone. The
+    tokens reserved for the call are reconciled with the `usage` of its response.
+    :param model: The OpenAI model the call is billed against
+    :param estimated_tokens: Estimated tokens used by the call
+    :param invoke: Callable invoking the OpenAI API
+    :param max_attempts: Number of attempts before the rate limit or transient error is raised
+    :return: The result of `invoke`
+    """
+    rate_limiter = get_rate_limiter(model)
+    for attempt in range(1, max_attempts + 1):
+        reserved_tokens = rate_limiter.acquire(estimated_tokens)
+        try:
+            response = invoke()
+        except openai.RateLimitError as e:
+            if attempt == max_attempts:
+                raise
+            delay = get_retry_after(e) or min(2**attempt, 60) * (1 + random.random() / 2)
+            logger.warning(
+                f"Rate limited by OpenAI for model: {model}, retrying in {delay:.1f} sec (attempt {attempt}/{max_attempts})"
+            )
+            rate_limiter.pause(delay)
+            continue
+        except TRANSIENT_ERRORS as e:
+            if attempt == max_attempts:
+                raise
+            delay = min(2 ** (attempt - 1), 30) * (1 + random.random() / 2)
+            logger.warning(
+                f"OpenAI request failed for model: {model}, retrying in {delay:.1f} sec (attempt {attempt}/{max_attempts}) | Error: {e}"
+            )
+            time.sleep(delay)
+            continue
+
+        used_tokens = get_used_tokens(response)
+        if used_tokens is not None:
+            rate_limiter.reconcile(reserved_tokens, used_tokens)
+        return response